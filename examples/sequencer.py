@@ -3,7 +3,7 @@ from blockaudio.audio_blocks import AudioTimedGroup, AudioFileBlock
 from blockaudio.audio_blocks import AudioFileInstru, AudioFormulaInstru
 from blockaudio import formulators
 
-instru_list = AudioFileInstru.load("/usr/share/hydrogen/data/drumkits/")
-instru_list = None
-sequencer = AudioSequencer(instru_list=instru_list)
+sequencer = AudioSequencer()
+#drumkit instruments are added to the list while the window is already up
+sequencer.scan_instru_library("/usr/share/hydrogen/data/drumkits/")
 sequencer.start()
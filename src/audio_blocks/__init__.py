@@ -4,6 +4,7 @@ from audio_samples_block import AudioSamplesBlock
 from audio_file_block import AudioFileBlock
 from audio_timed_group import AudioTimedGroup
 from audio_keypad_group import AudioKeypadGroup
+from audio_offline_renderer import AudioOfflineRenderer
 
 from audio_instru import AudioInstru
 from audio_file_instru import AudioFileInstru
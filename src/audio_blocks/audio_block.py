@@ -115,6 +115,7 @@ class AudioBlock(object):
 
     IdSeed = 0
     NameSeed = 0
+    VersionSeed = 0
     _APP_EPOCH_TIME = time.mktime(time.strptime("1 Jan 2017", "%d %b %Y"))
 
     TAG_NAME = "adblck"
@@ -126,6 +127,11 @@ class AudioBlock(object):
         elapsed_time = round(time.time()-AudioBlock._APP_EPOCH_TIME, 3)
         return "{0}_{1}".format(elapsed_time, AudioBlock.NameSeed).replace(".", "")
 
+    @staticmethod
+    def new_content_version():
+        AudioBlock.VersionSeed += 1
+        return AudioBlock.VersionSeed
+
     def __init__(self):
         self.paused = False
         self.loop = self.LOOP_STRETCH
@@ -153,6 +159,7 @@ class AudioBlock(object):
         AudioBlock.IdSeed += 1
         self.name = self.new_name()
         self.live_once=False
+        self.content_version = self.new_content_version()
 
     def copy_values_into(self, newob):
         newob.loop = self.loop
@@ -191,13 +198,14 @@ class AudioBlock(object):
         self.auto_fit_duration = bool(int(elm.attrib.get("auto_fit")))
         self.duration = self.duration_time.sample_count
         if elm.attrib.get("mchannel"):
-            self.midi_channel = int(elm.attrib.get("mchannel"))
-            self.midi_velocity = int(elm.attrib.get("mvelocity"))
+            self.set_midi_channel(elm.attrib.get("mchannel"))
+            self.set_midi_velocity(elm.attrib.get("mvelocity"))
 
     def recompute_time(self, beat):
         self.duration_time.recompute(beat)
         self.duration = self.duration_time.sample_count
         self.start_time.recompute(beat)
+        self.mark_content_changed()
 
     def __eq__(self, other):
         return isinstance(other, AudioBlock) and other.id_num == self.id_num
@@ -208,6 +216,17 @@ class AudioBlock(object):
     def set_owner(self, owner):
         self.owner = owner
 
+    def mark_content_changed(self):
+        self.content_version = self.new_content_version()
+        if self.owner:
+            self.owner.mark_content_changed()
+
+    def mark_duration_changed(self):
+        self.mark_content_changed()
+        #the owner places its blocks by their end, so it has to lay them out again
+        if self.owner:
+            self.owner.calculate_duration()
+
     def set_current_pos(self, current_pos):
         self.current_pos = int(current_pos)
 
@@ -218,7 +237,18 @@ class AudioBlock(object):
         self.music_note = note
 
     def set_midi_channel(self, channel):
-        self.midi_channel = int(channel)
+        channel = int(channel)
+        if channel<0 or channel>MidiMessage.MAX_CHANNEL:
+            return
+        self.midi_channel = channel
+        self.mark_content_changed()
+
+    def set_midi_velocity(self, velocity):
+        self.midi_velocity = min(max(int(velocity), 0), MidiMessage.MAX_DATA)
+        self.mark_content_changed()
+
+    def has_midi_content(self):
+        return self.midi_channel is not None
 
     def set_instru(self, instru):
         self.instru = instru
@@ -228,11 +258,13 @@ class AudioBlock(object):
 
     def set_loop(self, loop):
         self.loop = loop
+        self.mark_content_changed()
 
     def set_note(self, note):
         self.music_note = note
         if self.instru:
             self.instru.refill_block(self)
+        self.mark_content_changed()
 
     def set_no_loop(self):
         self.loop = self.LOOP_NEVER_EVER
@@ -260,6 +292,7 @@ class AudioBlock(object):
         self.auto_fit_duration = False
         self.duration_time.set_sample_count(duration, beat)
         self.duration = self.duration_time.sample_count
+        self.mark_duration_changed()
 
     def set_duration_value(self, duration_value, beat):
         if duration_value <= 0:
@@ -267,6 +300,7 @@ class AudioBlock(object):
         self.auto_fit_duration = False
         self.duration_time.set_value(duration_value, beat)
         self.duration = self.duration_time.sample_count
+        self.mark_duration_changed()
 
     def set_duration_unit(self, duration_unit, beat):
         self.duration_time.set_unit(duration_unit, beat)
@@ -293,9 +327,25 @@ class AudioBlock(object):
     def get_time_duration(self):
         return self.duration/AudioBlock.SampleRate
 
-    def get_samples(self, frame_count, start_from=None, use_loop=True, loop=None):
+    def get_samples(self, frame_count, start_from=None, use_loop=True, loop=None,
+                          out=None, offline=False):
+        if out is not None:
+            return AudioMessage(out)
         return AudioMessage(self.get_blank_data(frame_count))
 
+    def load_samples(self):
+        pass
+
+    def reset_after_fork(self, reset_blocks):
+        #a lock held by another thread at fork time is never released in the child
+        self.lock = threading.RLock()
+
+    def prefetch_samples(self, start_pos=0, end_pos=None):
+        pass
+
+    def are_samples_loaded(self, start_pos=0, end_pos=None):
+        return True
+
     def get_description(self):
         if self.instru:
             desc = self.instru.get_description()
@@ -325,6 +375,11 @@ class AudioBlock(object):
             return set([self.instru])
         return None
 
+    @staticmethod
+    def get_wrap_starts(start_pos, end_pos, period):
+        first_wrap_start = start_pos-start_pos%period
+        return numpy.arange(first_wrap_start, end_pos, period)
+
     @staticmethod
     def get_blank_data(sample_count):
         return numpy.zeros((sample_count, AudioBlock.ChannelCount), dtype=numpy.float32)
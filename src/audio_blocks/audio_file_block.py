@@ -1,58 +1,247 @@
 import time, numpy, os
+import threading
+import Queue
+import weakref
+import collections
+import hashlib
 import moviepy.editor as movie_editor
 from audio_block import AudioBlock
 from audio_samples_block import AudioSamplesBlock
+from audio_file_reader import AudioFileInfo, AudioFileMappedReader, AudioFileStreamReader
+from ..commons import AudioMessage, settings
 
 class AudioFileBlockCache(object):
-    TotalMemory = 0
-    Files = dict()
-    AccessTimeList = []
     MEMORY_LIMIT = 500*1024*1024
+    TotalMemory = 0
+    #key -> (samples, blocks using them), least recently used first
+    Entries = collections.OrderedDict()
+    HitCount = 0
+    MissCount = 0
+    EvictionCount = 0
+    Lock = threading.RLock()
+
+    @classmethod
+    def get(cls, key, block):
+        cls.Lock.acquire()
+        entry = cls.Entries.pop(key, None)
+        if entry is None:
+            cls.MissCount += 1
+            samples = None
+        else:
+            #python2 OrderedDict has no move_to_end, re-inserting is still O(1)
+            cls.Entries[key] = entry
+            entry[1].add(block)
+            cls.HitCount += 1
+            samples = entry[0]
+        cls.Lock.release()
+        return samples
+
+    @classmethod
+    def touch(cls, key):
+        cls.Lock.acquire()
+        entry = cls.Entries.pop(key, None)
+        if entry is not None:
+            cls.Entries[key] = entry
+        cls.Lock.release()
+
+    @classmethod
+    def put(cls, key, samples, block):
+        cls.Lock.acquire()
+        entry = cls.Entries.pop(key, None)
+        if entry is not None:
+            cls.TotalMemory -= entry[0].nbytes
+        blocks = weakref.WeakSet()
+        blocks.add(block)
+        cls.Entries[key] = (samples, blocks)
+        cls.TotalMemory += samples.nbytes
+        cls.Lock.release()
+        cls.evict()
+
+    @classmethod
+    def release(cls, key, block):
+        cls.Lock.acquire()
+        entry = cls.Entries.get(key)
+        if entry is not None:
+            entry[1].discard(block)
+        cls.Lock.release()
+
+    @classmethod
+    def evict(cls):
+        evicted_blocks = []
+        cls.Lock.acquire()
+        #the most recently used entry is always kept, even if it alone is over budget
+        while len(cls.Entries)>1 and cls.TotalMemory>cls.MEMORY_LIMIT:
+            key, (samples, blocks) = cls.Entries.popitem(last=False)
+            cls.TotalMemory -= samples.nbytes
+            cls.EvictionCount += 1
+            evicted_blocks.extend(blocks)
+        cls.Lock.release()
+        for block in evicted_blocks:
+            block.unload_samples()
+
+    @classmethod
+    def set_memory_limit(cls, memory_limit):
+        cls.MEMORY_LIMIT = memory_limit
+        cls.evict()
+
+    @classmethod
+    def get_stats(cls):
+        return dict(
+            hits=cls.HitCount,
+            misses=cls.MissCount,
+            evictions=cls.EvictionCount,
+            entries=len(cls.Entries),
+            total_memory=cls.TotalMemory,
+            memory_limit=cls.MEMORY_LIMIT)
+
+class AudioFileDiskCache(object):
+    CACHE_DIR = os.path.join(settings.CACHE_DIR, "samples")
+    Enabled = True
+
+    @classmethod
+    def get_path(cls, filename, sample_count):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        key = "{0}:{1}:{2}:{3}:{4}:{5}".format(
+                    os.path.abspath(filename), stat.st_mtime, stat.st_size,
+                    int(AudioBlock.SampleRate), AudioBlock.ChannelCount, sample_count)
+        if isinstance(key, unicode):
+            key = key.encode("utf-8")
+        return os.path.join(cls.CACHE_DIR, hashlib.sha1(key).hexdigest()+".npy")
+
+    @classmethod
+    def load(cls, filename, sample_count):
+        if not cls.Enabled:
+            return None
+        path = cls.get_path(filename, sample_count)
+        if path is None or not os.path.isfile(path):
+            return None
+        try:
+            #read only mapping, pages are shared with other processes through the os
+            return numpy.load(path, mmap_mode="r")
+        except (IOError, ValueError):
+            return None
+
+    @classmethod
+    def save(cls, filename, sample_count, samples):
+        if not cls.Enabled:
+            return None
+        path = cls.get_path(filename, sample_count)
+        if path is None:
+            return None
+        temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        try:
+            if not os.path.isdir(cls.CACHE_DIR):
+                os.makedirs(cls.CACHE_DIR)
+            with open(temp_path, "wb") as f:
+                numpy.save(f, samples)
+            #readers never see a half written file
+            os.rename(temp_path, path)
+        except (IOError, OSError):
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+        return cls.load(filename, sample_count)
+
+class AudioFileBlockLoader(object):
+    ThreadCount = 2
+    Requests = Queue.Queue()
+    Pending = set()
+    Threads = []
+    Lock = threading.Lock()
+
+    @classmethod
+    def request(cls, block):
+        cls.Lock.acquire()
+        if block in cls.Pending or block.load_error is not None:
+            cls.Lock.release()
+            return
+        cls.Pending.add(block)
+        while len(cls.Threads)<cls.ThreadCount:
+            thread = threading.Thread(target=cls.run_worker)
+            thread.daemon = True
+            thread.start()
+            cls.Threads.append(thread)
+        cls.Lock.release()
+        cls.Requests.put(block)
+
+    @classmethod
+    def reset_after_fork(cls):
+        #the worker threads are not carried over, requests are loaded in place instead
+        cls.Requests = Queue.Queue()
+        cls.Pending = set()
+        cls.Threads = []
+        cls.Lock = threading.Lock()
+
+    @classmethod
+    def run_worker(cls):
+        while True:
+            block = cls.Requests.get()
+            try:
+                block.load_samples()
+            except Exception as e:
+                #not retried from the render path until the file is set again
+                block.load_error = e
+            cls.Lock.acquire()
+            cls.Pending.discard(block)
+            cls.Lock.release()
 
 class AudioFileClipSamples(object):
-    def __init__(self, filename):
-        self.set_filename(filename)
+    def __init__(self, filename, reader=None):
         self.mult = 1.
+        if reader is None:
+            self.set_filename(filename)
+        else:
+            self.filename = filename
+            self.set_reader(reader)
 
     def __mul__(self, other):
-        newob = AudioFileClipSamples(self.filename)
-        newob.mult = other
+        newob = AudioFileClipSamples(self.filename, self.reader.clone())
+        newob.mult = self.mult*other
         return newob
 
     def set_filename(self, filename):
         self.filename = filename
-        self.audioclip = movie_editor.AudioFileClip(filename)
-        sample_count = int(round(self.audioclip.duration*AudioBlock.SampleRate))
-        self.shape = (sample_count, self.audioclip.nchannels)
+        #uncompressed wav/aiff is mapped as it is, anything else is streamed through ffmpeg
+        reader = AudioFileMappedReader.open(filename)
+        if reader is None:
+            reader = AudioFileStreamReader.open(filename)
+        self.set_reader(reader)
+
+    def set_reader(self, reader):
+        self.reader = reader
+        self.shape = (reader.frame_count, AudioBlock.ChannelCount)
+
+    def reset_after_fork(self):
+        self.reader.reset_after_fork()
+
+    def read(self, start, end, blocking=True):
+        samples = self.reader.read(start, end, blocking)
+        if self.mult != 1.:
+            samples = samples*self.mult
+        return samples
 
     def __getitem__(self, key):
         if isinstance(key, tuple):
             start_key = key[0]
             end_key = key[1]
-            audioclip = self.audioclip
             if isinstance(start_key, slice):
-                if start_key.start:
-                    start_at = start_key.start*1./AudioBlock.SampleRate
-                else:
-                    start_at = 0
-
-                if start_at>=self.audioclip.duration:
-                    return numpy.zeros((0, self.audioclip.nchannels), dtype=numpy.float32)
-
-                if start_key.stop:
-                    end_at = start_key.stop*1./AudioBlock.SampleRate
-                    if end_at>self.audioclip.duration:
-                        end_at = self.audioclip.duration
+                start_at = start_key.start or 0
+                if start_key.stop is None:
+                    end_at = self.shape[0]
                 else:
-                    end_at = None
-
+                    end_at = start_key.stop
+                samples = self.reader.read(start_at, end_at)
                 start_key = slice(None, None, start_key.step)
-                audioclip = self.audioclip.subclip(start_at, end_at)
-                samples = audioclip.to_soundarray(buffersize=1000).astype(numpy.float32)
-                return samples[start_key, end_key]*self.mult
             else:
-                samples = self.mult*audioclip.get_frame(start_key*1./AudioBlock.SampleRate)
-                return samples[end_key]
+                samples = self.reader.read(start_key, start_key+1)[0]
+                return samples[end_key]*self.mult
+            samples = samples[start_key, end_key]
+            if self.mult != 1.:
+                samples = samples*self.mult
+            return samples
         else:
             raise IndexError()
 
@@ -63,9 +252,11 @@ class AudioFileBlock(AudioSamplesBlock):
         AudioSamplesBlock.__init__(self, samples=AudioBlock.get_blank_data(1))
         self.sample_count = sample_count
         self.filename = filename
-        self.last_access_at = None
         self.preload = preload
         self.samples_loaded = False
+        self.cache_key = None
+        self.load_lock = threading.Lock()
+        self.load_error = None
         self.calculate_duration()
         self.set_sample_count(self.inclusive_duration)
 
@@ -74,12 +265,13 @@ class AudioFileBlock(AudioSamplesBlock):
         self.remove_from_cache()
 
         self.filename = filename
+        self.load_error = None
         if isinstance(self.samples, AudioFileClipSamples):
             self.samples.set_filename(filename)
         else:
             self.calculate_duration()
             self.set_sample_count(self.inclusive_duration)
-            AudioFileBlockCache.Files[self.filename] = self
+        self.mark_content_changed()
 
 
     @staticmethod
@@ -102,38 +294,107 @@ class AudioFileBlock(AudioSamplesBlock):
         if self.sample_count:
             self.inclusive_duration = self.sample_count
         else:
-            audioclip = self.get_audio_clip()
-            self.inclusive_duration = int(audioclip.duration*AudioBlock.SampleRate)
+            info = AudioFileInfo.probe(self.filename)
+            if info is not None:
+                duration = info.duration
+                if self.preload:
+                    duration = min(duration, self.MAX_DURATION_SECONDS)
+            else:
+                duration = self.get_audio_clip().duration
+            self.inclusive_duration = int(duration*AudioBlock.SampleRate)
 
     def readjust(self):
         self.set_filename(self.filename)
 
+    def get_cache_key(self):
+        return (self.filename, self.sample_count, AudioBlock.SampleRate)
+
     def load_samples(self):
         if self.samples_loaded:
             return
+        #kept apart from self.lock, which the render thread takes on every buffer
+        self.load_lock.acquire()
+        try:
+            if not self.samples_loaded:
+                self.decode_samples()
+        finally:
+            self.load_lock.release()
+
+    def prefetch_samples(self, start_pos=0, end_pos=None):
+        if not self.samples_loaded:
+            AudioFileBlockLoader.request(self)
+
+    def reset_after_fork(self, reset_blocks):
+        super(AudioFileBlock, self).reset_after_fork(reset_blocks)
+        self.load_lock = threading.Lock()
+
+    def are_samples_loaded(self, start_pos=0, end_pos=None):
+        return self.samples_loaded
+
+    def decode_samples(self):
+        if self.preload:
+            cache_key = self.get_cache_key()
+            samples = AudioFileBlockCache.get(cache_key, self)
+            if samples is not None:
+                self.cache_key = cache_key
+                self.samples = samples
+                self.samples_loaded = True
+                return
+
+            reader = AudioFileMappedReader.open(self.filename)
+            if reader is not None and \
+                    reader.frame_count<self.MAX_DURATION_SECONDS*AudioBlock.SampleRate:
+                #plain pcm converts straight from the file, without ffmpeg or a disk copy
+                samples = self.fit_sample_count(reader.read(0, reader.frame_count))
+                self.set_cached_samples(cache_key, samples)
+                return
+
+            samples = AudioFileDiskCache.load(self.filename, self.sample_count)
+            if samples is not None:
+                self.set_cached_samples(cache_key, samples)
+                return
+
+        info = AudioFileInfo.probe(self.filename)
+        if info is not None and info.duration>=self.MAX_DURATION_SECONDS:
+            self.samples = AudioFileClipSamples(self.filename)
+            self.samples_loaded = True
+            return
 
-        self.last_access_at = time.time()
         audioclip = self.get_audio_clip()
 
         if self.preload and audioclip.duration<self.MAX_DURATION_SECONDS:
             try:
-                self.samples = audioclip.to_soundarray(buffersize=1000).astype(numpy.float32)
+                samples = audioclip.to_soundarray(buffersize=1000).astype(numpy.float32)
+                decoded = True
             except IOError as e:
-                self.samples = numpy.zeros((0, AudioBlock.ChannelCount), dtype=numpy.float32)
-
-            if self.sample_count:
-                self.samples = self.samples[:self.sample_count, :]
-                if self.samples.shape[0]<self.sample_count:
-                    blank_count = self.sample_count-self.samples.shape[0]
-                    blank_data = numpy.zeros((blank_count, self.samples.shape[1]), dtype=numpy.float32)
-                    self.samples = numpy.append(self.samples, blank_data, axis=0)
-
-            AudioFileBlockCache.Files[self.filename] = self
-            AudioFileBlockCache.TotalMemory  += self.samples.nbytes
-            self.clean_memory(exclude=self)
+                samples = numpy.zeros((0, AudioBlock.ChannelCount), dtype=numpy.float32)
+                decoded = False
+
+            samples = self.fit_sample_count(samples)
+            if decoded and os.path.isfile(self.filename):
+                mapped_samples = AudioFileDiskCache.save(
+                                        self.filename, self.sample_count, samples)
+                if mapped_samples is not None:
+                    samples = mapped_samples
+            self.set_cached_samples(cache_key, samples)
         else:
             self.samples = AudioFileClipSamples(self.filename)
+            self.samples_loaded = True
+
+    def fit_sample_count(self, samples):
+        if self.sample_count:
+            samples = samples[:self.sample_count, :]
+            if samples.shape[0]<self.sample_count:
+                blank_count = self.sample_count-samples.shape[0]
+                blank_data = numpy.zeros((blank_count, samples.shape[1]), dtype=numpy.float32)
+                samples = numpy.append(samples, blank_data, axis=0)
+        return samples
+
+    def set_cached_samples(self, cache_key, samples):
+        self.cache_key = cache_key
+        self.samples = samples
         self.samples_loaded = True
+        AudioFileBlockCache.put(cache_key, samples, self)
 
     def get_full_samples(self):
         self.load_samples()
@@ -143,36 +404,36 @@ class AudioFileBlock(AudioSamplesBlock):
         if not self.samples_loaded:
             return
 
-        if not isinstance(self.samples, AudioFileClipSamples):
-            AudioFileBlockCache.TotalMemory -= self.samples.nbytes
-        self.samples = AudioBlock.get_blank_data(1)
         self.samples_loaded = False
+        self.samples = AudioBlock.get_blank_data(1)
+        self.remove_from_cache()
 
-    def get_samples(self, frame_count, start_from=None, use_loop=True, loop=None):
-        self.load_samples()
+    def get_samples(self, frame_count, start_from=None, use_loop=True, loop=None,
+                          out=None, offline=False):
+        if not self.samples_loaded:
+            if not offline:
+                #never decode in the render thread, even when paused,
+                #play silence until it is ready
+                AudioFileBlockLoader.request(self)
+                if out is None:
+                    out = self.get_blank_data(frame_count)
+                return AudioMessage(out)
+            self.load_samples()
+        if self.cache_key is not None:
+            AudioFileBlockCache.touch(self.cache_key)
         return AudioSamplesBlock.get_samples(
-                self, frame_count, start_from=start_from, use_loop=use_loop, loop=loop)
+                self, frame_count, start_from=start_from, use_loop=use_loop, loop=loop,
+                out=out, offline=offline)
 
     def get_description(self):
         return self.name
 
     def remove_from_cache(self):
-        if self.filename in AudioFileBlockCache.Files:
-            del AudioFileBlockCache.Files[self.filename]
-        self.last_access_at = None
+        if self.cache_key is not None:
+            AudioFileBlockCache.release(self.cache_key, self)
+            self.cache_key = None
 
     def destroy(self):
         self.unload_samples()
         self.remove_from_cache()
         super(AudioSamplesBlock, self).destroy()
-
-    @staticmethod
-    def clean_memory(exclude):
-        sorted_files = sorted(AudioFileBlockCache.Files.values(),
-                                key=lambda cache: cache.last_access_at)
-        while sorted_files and AudioFileBlockCache.TotalMemory>AudioFileBlockCache.MEMORY_LIMIT:
-            first_file = sorted_files[0]
-            if exclude and first_file.filename == exclude.filename:
-                continue
-            sorted_files = sorted_files[1:]
-            first_file.unload_samples()
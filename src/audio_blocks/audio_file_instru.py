@@ -1,6 +1,7 @@
 from audio_samples_instru import AudioSamplesInstru
 from audio_file_block import AudioFileBlock, AudioFileClipSamples
-import moviepy.editor as moviepy_editor
+from audio_file_reader import AudioFileInfo
+from audio_file_library import AudioFileLibrary
 import os
 
 class AudioFileInstru(AudioSamplesInstru):
@@ -47,10 +48,10 @@ class AudioFileInstru(AudioSamplesInstru):
         return AudioFileBlock(self.filename, self.sample_count)
 
     def get_duration_seconds(self):
-        if not os.path.isfile(self.filename):
+        info = AudioFileInfo.probe(self.filename)
+        if info is None:
             return 0.
-        clip = moviepy_editor.AudioFileClip(self.filename)
-        return clip.duration
+        return info.duration
 
     def get_samples_for(self, note):
         if self.samples is None:
@@ -68,33 +69,20 @@ class AudioFileInstru(AudioSamplesInstru):
             self.base_block.set_filename(filename)
         self.readjust_blocks()
 
+    @classmethod
+    def scan(cls, filepath, prefix='', recursive=True, test=False, library=None):
+        if library is None:
+            library = AudioFileLibrary()
+        for child_path, name in library.scan(filepath, prefix, recursive, test):
+            instru = AudioFileInstru(child_path)
+            instru.set_name(name)
+            yield instru
+
     @classmethod
     def load(cls, filepath, prefix='', recursive=True, test=False):
+        instru_list = list(cls.scan(filepath, prefix, recursive, test))
         if os.path.isdir(filepath):
-            instru_list = []
-            for filename in os.listdir(filepath):
-                child_path = os.path.join(filepath, filename)
-                if os.path.isdir(child_path):
-                    if not recursive:
-                        continue
-                    else:
-                        child_prefix = prefix + filename + "/"
-                else:
-                    child_prefix = prefix
-                instru = cls.load(child_path, prefix=child_prefix)
-                if instru:
-                    instru_list.extend(instru)
             return instru_list
-        if test:
-            try:
-                clip = moviepy_editor.AudioFileClip(filepath)
-            except:
-                clip = None
-        else:
-            clip = None
-        if not test or (clip and clip.duration>0):
-            del clip
-            instru = AudioFileInstru(filepath)
-            instru.set_name(prefix + os.path.splitext(os.path.basename(filepath))[0])
-            return [instru]
+        if instru_list:
+            return instru_list
         return None
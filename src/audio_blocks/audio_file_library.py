@@ -0,0 +1,129 @@
+import os
+import json
+import threading
+from multiprocessing.pool import ThreadPool
+from audio_file_reader import AudioFileInfo
+from ..commons import settings
+
+class AudioFileLibrary(object):
+    INDEX_PATH = os.path.join(settings.CACHE_DIR, "library_index.json")
+    ThreadCount = 8
+
+    def __init__(self, index_path=None):
+        if index_path is None:
+            index_path = self.INDEX_PATH
+        self.index_path = index_path
+        self.lock = threading.Lock()
+        self.index_changed = False
+        #directory path -> dict(mtime, dirs, files, durations)
+        self.index = dict()
+        try:
+            with open(index_path, "r") as f:
+                self.index = json.load(f)
+        except (IOError, ValueError):
+            pass
+
+    def save_index(self):
+        if not self.index_changed:
+            return
+        temp_path = "{0}.{1}.tmp".format(self.index_path, os.getpid())
+        try:
+            index_dir = os.path.dirname(self.index_path)
+            if not os.path.isdir(index_dir):
+                os.makedirs(index_dir)
+            self.lock.acquire()
+            try:
+                with open(temp_path, "w") as f:
+                    json.dump(self.index, f)
+            finally:
+                self.lock.release()
+            os.rename(temp_path, self.index_path)
+            self.index_changed = False
+        except (IOError, OSError, ValueError):
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def get_dir_entry(self, dirpath):
+        key = os.path.abspath(dirpath)
+        mtime = os.path.getmtime(dirpath)
+        self.lock.acquire()
+        entry = self.index.get(key)
+        self.lock.release()
+        #adding, removing or renaming a child changes the directory mtime
+        if entry is not None and entry["mtime"] == mtime:
+            return entry
+
+        dirs = []
+        files = []
+        for filename in sorted(os.listdir(dirpath)):
+            if os.path.isdir(os.path.join(dirpath, filename)):
+                dirs.append(filename)
+            else:
+                files.append(filename)
+        entry = dict(mtime=mtime, dirs=dirs, files=files, durations=dict())
+        self.lock.acquire()
+        self.index[key] = entry
+        self.index_changed = True
+        self.lock.release()
+        return entry
+
+    def walk(self, filepath, prefix, recursive):
+        if not os.path.isdir(filepath):
+            yield (filepath, prefix, None)
+            return
+        pending = [(filepath, prefix)]
+        while pending:
+            dirpath, dir_prefix = pending.pop()
+            try:
+                entry = self.get_dir_entry(dirpath)
+            except OSError:
+                continue
+            for filename in entry["files"]:
+                yield (os.path.join(dirpath, filename), dir_prefix, entry)
+            if recursive:
+                for filename in reversed(entry["dirs"]):
+                    pending.append((os.path.join(dirpath, filename), dir_prefix+filename+"/"))
+
+    def probe(self, candidate):
+        filepath, prefix, entry = candidate
+        filename = os.path.basename(filepath)
+        duration = None
+        if entry is not None:
+            self.lock.acquire()
+            duration = entry["durations"].get(filename)
+            self.lock.release()
+        if duration is None:
+            info = AudioFileInfo.probe(filepath)
+            if info is None:
+                duration = 0.
+            else:
+                duration = info.duration
+            if entry is not None:
+                self.lock.acquire()
+                entry["durations"][filename] = duration
+                self.index_changed = True
+                self.lock.release()
+        return (filepath, prefix, duration)
+
+    def scan(self, filepath, prefix="", recursive=True, test=False):
+        if not test:
+            for filepath, file_prefix, entry in self.walk(filepath, prefix, recursive):
+                yield (filepath, self.get_name(filepath, file_prefix))
+            self.save_index()
+            return
+
+        pool = ThreadPool(self.ThreadCount)
+        try:
+            #files come back as soon as they are probed, not in walk order
+            for filepath, file_prefix, duration in pool.imap_unordered(
+                            self.probe, self.walk(filepath, prefix, recursive)):
+                if duration>0:
+                    yield (filepath, self.get_name(filepath, file_prefix))
+        finally:
+            pool.terminate()
+            pool.join()
+            self.save_index()
+
+    @staticmethod
+    def get_name(filepath, prefix):
+        return prefix + os.path.splitext(os.path.basename(filepath))[0]
@@ -0,0 +1,408 @@
+import numpy
+import threading
+import struct
+import os
+from moviepy.audio.io.readers import FFMPEG_AudioReader
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+from audio_block import AudioBlock
+
+class AudioFileHeader(object):
+    WAVE_FORMAT_PCM = 0x0001
+    WAVE_FORMAT_IEEE_FLOAT = 0x0003
+    WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+    #aifc compression type -> (is float, is big endian)
+    AIFC_COMPRESSIONS = {
+        "NONE": (False, True),
+        "twos": (False, True),
+        "sowt": (False, False),
+        "fl32": (True, True),
+        "FL32": (True, True),
+        "fl64": (True, True),
+        "FL64": (True, True),
+    }
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.sample_rate = 0
+        self.channel_count = 0
+        self.frame_count = 0
+        self.sample_width = 0
+        self.is_float = False
+        self.is_big_endian = False
+        self.is_unsigned = False
+        self.data_offset = 0
+
+    @property
+    def duration(self):
+        return self.frame_count*1./self.sample_rate
+
+    @classmethod
+    def read(cls, filename):
+        ext = os.path.splitext(filename)[1].lower()
+        if ext not in (".wav", ".wave", ".aif", ".aiff", ".aifc"):
+            return None
+        header = cls(filename)
+        try:
+            with open(filename, "rb") as f:
+                chunk_id = f.read(4)
+                if chunk_id == "RIFF":
+                    parsed = header.parse_wave(f)
+                elif chunk_id == "FORM":
+                    parsed = header.parse_aiff(f)
+                else:
+                    parsed = False
+            file_size = os.path.getsize(filename)
+        except (IOError, OSError, struct.error):
+            return None
+        if not parsed or header.sample_rate<=0 or header.channel_count<=0:
+            return None
+        if not header.is_float and header.sample_width not in (1, 2, 3, 4):
+            return None
+        if header.is_float and header.sample_width not in (4, 8):
+            return None
+        #streamed files often carry a bogus data size, so trust the file size too
+        frame_size = header.sample_width*header.channel_count
+        header.frame_count = max(min(
+            header.frame_count, (file_size-header.data_offset)//frame_size), 0)
+        return header
+
+    def parse_wave(self, f):
+        f.read(4)
+        if f.read(4) != "WAVE":
+            return False
+        format_tag = None
+        while True:
+            chunk_head = f.read(8)
+            if len(chunk_head)<8:
+                return False
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk_head)
+            if chunk_id == "fmt ":
+                fmt = f.read(chunk_size)
+                format_tag, self.channel_count, self.sample_rate, byte_rate, \
+                    block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+                if format_tag == self.WAVE_FORMAT_EXTENSIBLE and chunk_size>=26:
+                    format_tag = struct.unpack("<H", fmt[24:26])[0]
+                self.sample_width = bits//8
+                if chunk_size%2:
+                    f.read(1)
+            elif chunk_id == "data":
+                if format_tag == self.WAVE_FORMAT_PCM:
+                    self.is_float = False
+                elif format_tag == self.WAVE_FORMAT_IEEE_FLOAT:
+                    self.is_float = True
+                else:
+                    return False
+                self.is_unsigned = self.sample_width == 1
+                self.data_offset = f.tell()
+                self.frame_count = chunk_size//(self.sample_width*self.channel_count)
+                return True
+            else:
+                f.seek(chunk_size+chunk_size%2, 1)
+
+    def parse_aiff(self, f):
+        f.read(4)
+        form_type = f.read(4)
+        if form_type not in ("AIFF", "AIFC"):
+            return False
+        self.is_big_endian = True
+        has_comm = False
+        while True:
+            chunk_head = f.read(8)
+            if len(chunk_head)<8:
+                return False
+            chunk_id, chunk_size = struct.unpack(">4sI", chunk_head)
+            if chunk_id == "COMM":
+                comm = f.read(chunk_size)
+                self.channel_count, self.frame_count, bits = \
+                        struct.unpack(">hIh", comm[:8])
+                self.sample_rate = self.parse_extended(comm[8:18])
+                self.sample_width = (bits+7)//8
+                if form_type == "AIFC":
+                    compression = self.AIFC_COMPRESSIONS.get(comm[18:22])
+                    if compression is None:
+                        return False
+                    self.is_float, self.is_big_endian = compression
+                    if self.is_float:
+                        self.sample_width = 8 if comm[18:22].lower() == "fl64" else 4
+                has_comm = True
+                if chunk_size%2:
+                    f.read(1)
+            elif chunk_id == "SSND":
+                if not has_comm:
+                    return False
+                offset, block_size = struct.unpack(">II", f.read(8))
+                self.data_offset = f.tell()+offset
+                return True
+            else:
+                f.seek(chunk_size+chunk_size%2, 1)
+
+    @staticmethod
+    def parse_extended(data):
+        #80 bit ieee extended float, as used for the aiff sample rate
+        exponent, mantissa = struct.unpack(">HQ", data)
+        sign = -1 if exponent & 0x8000 else 1
+        exponent &= 0x7FFF
+        if exponent == 0 and mantissa == 0:
+            return 0
+        return sign*mantissa*2.**(exponent-16383-63)
+
+    def get_mapped_data(self):
+        if self.sample_width == 3:
+            dtype = numpy.dtype("u1")
+            shape = (self.frame_count, self.channel_count, 3)
+        else:
+            if self.is_float:
+                kind = "f"
+            elif self.is_unsigned:
+                kind = "u"
+            else:
+                kind = "i"
+            dtype = numpy.dtype("{0}{1}{2}".format(
+                    ">" if self.is_big_endian else "<", kind, self.sample_width))
+            shape = (self.frame_count, self.channel_count)
+        if self.frame_count == 0:
+            return numpy.zeros(shape, dtype=dtype)
+        return numpy.memmap(self.filename, dtype=dtype, mode="r",
+                            offset=self.data_offset, shape=shape)
+
+    def to_float(self, data):
+        if self.is_float:
+            return data.astype(numpy.float32)
+        if self.sample_width == 3:
+            data = data.astype(numpy.int32)
+            if self.is_big_endian:
+                data = (data[:, :, 0]<<24)|(data[:, :, 1]<<16)|(data[:, :, 2]<<8)
+            else:
+                data = (data[:, :, 2]<<24)|(data[:, :, 1]<<16)|(data[:, :, 0]<<8)
+            #the bytes sit at the top of the int32, so the sign comes along
+            return data.astype(numpy.float32)*(1./2**31)
+        samples = data.astype(numpy.float32)
+        if self.is_unsigned:
+            samples -= 128
+        samples *= 1./2**(8*self.sample_width-1)
+        return samples
+
+class AudioFileInfo(object):
+    #absolute path -> (mtime, size, info), a file is probed again only once it changes
+    Cache = {}
+    Lock = threading.Lock()
+
+    def __init__(self, filename, duration, sample_rate, channel_count, header=None):
+        self.filename = filename
+        self.duration = duration
+        self.sample_rate = sample_rate
+        self.channel_count = channel_count
+        self.header = header
+
+    @classmethod
+    def probe(cls, filename):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        key = os.path.abspath(filename)
+        cls.Lock.acquire()
+        entry = cls.Cache.get(key)
+        cls.Lock.release()
+        if entry is not None and entry[0] == stat.st_mtime and entry[1] == stat.st_size:
+            return entry[2]
+
+        header = AudioFileHeader.read(filename)
+        if header is not None:
+            info = cls(filename, header.duration, header.sample_rate,
+                       header.channel_count, header)
+        else:
+            info = cls.probe_ffmpeg(filename)
+
+        cls.Lock.acquire()
+        cls.Cache[key] = (stat.st_mtime, stat.st_size, info)
+        cls.Lock.release()
+        return info
+
+    @classmethod
+    def probe_ffmpeg(cls, filename):
+        #ffmpeg only prints the stream info here, nothing is decoded
+        try:
+            infos = ffmpeg_parse_infos(filename)
+        except (IOError, OSError, IndexError):
+            return None
+        if not infos.get("audio_found") or not infos.get("duration"):
+            return None
+        sample_rate = infos.get("audio_fps")
+        if not isinstance(sample_rate, int):
+            sample_rate = None
+        #ffmpeg output is always decoded to this many channels
+        return cls(filename, infos["duration"], sample_rate, AudioBlock.ChannelCount)
+
+class AudioFileMappedReader(object):
+    def __init__(self, header):
+        self.header = header
+        self.filename = header.filename
+        self.data = header.get_mapped_data()
+        self.frame_count = header.frame_count
+
+    @classmethod
+    def open(cls, filename):
+        info = AudioFileInfo.probe(filename)
+        if info is None or info.header is None:
+            return None
+        header = info.header
+        if header.sample_rate != AudioBlock.SampleRate:
+            return None
+        if header.channel_count not in (1, AudioBlock.ChannelCount):
+            return None
+        try:
+            return cls(header)
+        except (IOError, ValueError):
+            return None
+
+    def clone(self):
+        #the mapping has no read position, so it is safe to share
+        return self
+
+    def reset_after_fork(self):
+        pass
+
+    def read(self, start, end, blocking=True):
+        end = min(end, self.frame_count)
+        if start>=end:
+            return AudioBlock.get_blank_data(0)
+        samples = self.header.to_float(self.data[start:end])
+        if samples.shape[1] != AudioBlock.ChannelCount:
+            samples = numpy.repeat(samples, AudioBlock.ChannelCount, axis=1)
+        return samples
+
+class AudioFileStreamReader(object):
+    WindowSeconds = 4.
+    #readers inherited through a fork, their ffmpeg process still belongs to the parent
+    ForkedReaders = []
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.window_frames = int(self.WindowSeconds*AudioBlock.SampleRate)
+        self.open_reader()
+        self.frame_count = int(round(self.reader.duration*AudioBlock.SampleRate))
+
+    def open_reader(self):
+        #the reader decodes its first buffer when created, that becomes the first window
+        self.reader = FFMPEG_AudioReader(
+                    self.filename, buffersize=self.window_frames,
+                    fps=int(AudioBlock.SampleRate), nbytes=2,
+                    nchannels=AudioBlock.ChannelCount)
+        self.window = (0, self.reader.buffer.astype(numpy.float32))
+        self.ahead = (None, None)
+        self.ahead_thread = None
+        #guards the ffmpeg pipe, shared by the render and read-ahead threads
+        self.lock = threading.Lock()
+
+    def reset_after_fork(self):
+        #reading the inherited pipe would steal the parent's data, and letting the
+        #old reader be collected would terminate the parent's ffmpeg
+        self.ForkedReaders.append(self.reader)
+        self.open_reader()
+
+    @classmethod
+    def open(cls, filename):
+        return cls(filename)
+
+    def clone(self):
+        return type(self)(self.filename)
+
+    def decode(self, start):
+        #seek only reopens ffmpeg when going backward or far forward
+        if self.reader.pos != start:
+            self.reader.seek(start)
+        return self.reader.read_chunk(self.window_frames).astype(numpy.float32)
+
+    def read_ahead(self, start):
+        self.lock.acquire()
+        try:
+            self.ahead = (start, self.decode(start))
+        finally:
+            self.lock.release()
+
+    def request_read_ahead(self, start):
+        if start>=self.frame_count or self.ahead[0] == start:
+            return
+        if self.ahead_thread is not None and self.ahead_thread.is_alive():
+            return
+        self.ahead_thread = threading.Thread(target=self.read_ahead, args=(start,))
+        self.ahead_thread.daemon = True
+        self.ahead_thread.start()
+
+    def load_window(self, start, end):
+        if self.ahead_thread is not None:
+            self.ahead_thread.join()
+            self.ahead_thread = None
+        window_start, window = self.window
+        window_end = window_start+window.shape[0]
+        parts = []
+        if window_start<=start<window_end:
+            parts.append(window[start-window_start:, :])
+            pos = window_end
+        else:
+            pos = start
+        ahead_start, ahead = self.ahead
+        self.ahead = (None, None)
+        if ahead_start == pos and ahead is not None and pos<end:
+            parts.append(ahead)
+            pos += ahead.shape[0]
+        self.lock.acquire()
+        try:
+            while pos<end:
+                samples = self.decode(pos)
+                if samples.shape[0] == 0:
+                    break
+                parts.append(samples)
+                pos += samples.shape[0]
+        finally:
+            self.lock.release()
+        if not parts:
+            return (start, AudioBlock.get_blank_data(0))
+        return (start, numpy.concatenate(parts, axis=0))
+
+    def take_read_ahead(self, start):
+        if self.ahead_thread is not None and self.ahead_thread.is_alive():
+            return self.window
+        window_start, window = self.window
+        window_end = window_start+window.shape[0]
+        ahead_start, ahead = self.ahead
+        if ahead is None:
+            return self.window
+        if window_start<=start<window_end and ahead_start == window_end:
+            #the rest of the window joins the read ahead, so a read across both is whole
+            self.ahead = (None, None)
+            return (start, numpy.concatenate((window[start-window_start:, :], ahead), axis=0))
+        if ahead_start<=start<ahead_start+ahead.shape[0]:
+            self.ahead = (None, None)
+            return (ahead_start, ahead)
+        return self.window
+
+    def read(self, start, end, blocking=True):
+        end = min(end, self.frame_count)
+        if start>=end:
+            return AudioBlock.get_blank_data(0)
+        window_start, window = self.window
+        if start<window_start or end>window_start+window.shape[0]:
+            if blocking:
+                self.window = self.load_window(start, end)
+            else:
+                #decoding here would stall the render thread, the read ahead catches up instead
+                self.window = self.take_read_ahead(start)
+            window_start, window = self.window
+        window_end = window_start+window.shape[0]
+        if not window_start<=start<window_end:
+            self.request_read_ahead(start)
+        elif end-window_start>window.shape[0]//2:
+            self.request_read_ahead(window_end)
+
+        copy_start = min(max(start, window_start), end)
+        copy_end = max(min(end, window_end), copy_start)
+        if copy_start == start and copy_end == end:
+            return window[start-window_start:end-window_start, :]
+        #ffmpeg may come up short near the end of the file, and unread parts play silent
+        samples = AudioBlock.get_blank_data(end-start)
+        samples[copy_start-start:copy_end-start, :] = \
+                window[copy_start-window_start:copy_end-window_start, :]
+        return samples
@@ -1,5 +1,5 @@
 from audio_instru import AudioInstru
-from ..commons import MusicNote, SamplesProcessor
+from ..commons import MusicNote
 from audio_samples_block import AudioSamplesBlock
 from audio_block import AudioBlock, AudioBlockTime
 import imp
@@ -19,6 +19,7 @@ class AudioFormulaInstru(AudioInstru):
 
         self.formulator_path = None
         self.notes_samples = dict()
+        self.notes_version = self.content_version
         self.autogen_other_notes = True
 
         if formulator is None:
@@ -132,6 +133,9 @@ class AudioFormulaInstru(AudioInstru):
 
         if isinstance(note, str):
             note = MusicNote.get_note(note)
+        if self.notes_version != self.content_version:
+            self.notes_samples.clear()
+            self.notes_version = self.content_version
         if note.name not in self.notes_samples:
             if note.name == self.base_note.name or not self.autogen_other_notes:
                 samples = self.formulator.get_note_samples(note)
@@ -140,7 +144,7 @@ class AudioFormulaInstru(AudioInstru):
                     samples.shape = (-1, AudioBlock.ChannelCount)
             else:
                 factor = note.frequency/self.base_note.frequency
-                samples = SamplesProcessor.speed_up(
+                samples = self.shift_note_samples(
                     self.get_samples_for(self.base_note), factor)
             self.notes_samples[note.name] = samples
         else:
@@ -156,13 +160,12 @@ class AudioFormulaInstru(AudioInstru):
         return note_block
 
     def readjust_blocks(self):
+        self.mark_content_changed()
         if not self.notes_samples:
             return
-        for note_name in self.notes_samples:
-            del self.notes_samples[note_name]
-            self.notes_samples[note_name] = self.get_samples_for(note_name)
         for block in self.blocks:
-            block.set_samples(self.notes_samples[block.music_note])
+            block.set_samples(self.get_samples_for(block.music_note))
+        self.recalculate_owner_durations()
 
     def refill_block(self, block):
         block.set_samples(self.get_samples_for(block.music_note))
@@ -1,9 +1,11 @@
 import time
 from xml.etree.ElementTree import Element as XmlElement
+from ..commons import SamplesProcessor
 
 class AudioInstru(object):
     IdSeed = 0
     NameSeed = 0
+    VersionSeed = 0
     EPOCH_TIME = time.mktime(time.strptime("1 Jan 2017", "%d %b %Y"))
     TAG_NAME = "instru"
     TYPE_NAME = ""
@@ -21,15 +23,19 @@ class AudioInstru(object):
         self.id_num = AudioInstru.IdSeed
         AudioInstru.IdSeed += 1
         self.blocks = []
+        self.keep_note_length = False
+        self.mark_content_changed()
 
     def get_xml_element(self):
         elm = XmlElement(self.TAG_NAME)
         elm.attrib["type"] = self.TYPE_NAME
         elm.attrib["name"] = "{0}".format(self.get_name())
+        elm.attrib["keep_note_length"] = "{0}".format(int(self.keep_note_length))
         return elm
 
     def load_from_xml(self, elm):
         self.set_name(elm.attrib.get("name"))
+        self.keep_note_length = bool(int(elm.attrib.get("keep_note_length", 0)))
 
     def set_name(self, name):
         self.name = name
@@ -49,6 +55,10 @@ class AudioInstru(object):
     def get_description(self):
         return self.name
 
+    def mark_content_changed(self):
+        AudioInstru.VersionSeed += 1
+        self.content_version = AudioInstru.VersionSeed
+
     def add_block(self, block):
         self.blocks.append(block)
 
@@ -56,7 +66,27 @@ class AudioInstru(object):
         if block in self.blocks:
             self.blocks.remove(block)
 
+    def set_keep_note_length(self, keep_note_length):
+        self.keep_note_length = keep_note_length
+        self.readjust_blocks()
+
+    def shift_note_samples(self, samples, factor):
+        #speeding up makes higher notes shorter, pitch shifting keeps the base note length
+        if self.keep_note_length:
+            return SamplesProcessor.pitch_shift(samples, factor)
+        return SamplesProcessor.speed_up(samples, factor)
+
     def readjust_blocks(self):
+        self.mark_content_changed()
         for block in self.blocks:
             block.readjust()
+        self.recalculate_owner_durations()
+
+    def recalculate_owner_durations(self):
+        owners = set()
+        for block in self.blocks:
+            if block.owner:
+                owners.add(block.owner)
+        for owner in owners:
+            owner.calculate_duration()
 
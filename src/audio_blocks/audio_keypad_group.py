@@ -71,28 +71,15 @@ class AudioKeypadGroup(AudioGroup):
             self.history[block.get_id()] = [block.music_note, time.time(), None]
         return block
 
-    def get_samples(self, frame_count, loop=None):
-        self.lock.acquire()
-        block_count = len(self.blocks)
-        self.lock.release()
-        audio_message = super(AudioKeypadGroup, self).get_samples(frame_count)
-
-        for i in xrange(block_count):
-            self.lock.acquire()
-            if i <len(self.blocks):
-                block = self.blocks[i]
-            else:
-                block = None
-            self.lock.release()
-
-            if not block:
-                break
+    def get_samples(self, frame_count, loop=None, out=None):
+        audio_message = super(AudioKeypadGroup, self).get_samples(frame_count, out=out)
 
-            self.lock.acquire()
+        for block in self.blocks_snapshot:
             if block.is_stopped():
+                self.lock.acquire()
                 if self.record:
                     self.history[block.get_id()][2] = time.time()
                 block.destroy()
-            self.lock.release()
+                self.lock.release()
 
         return audio_message
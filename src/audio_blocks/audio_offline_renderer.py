@@ -0,0 +1,74 @@
+import multiprocessing
+import threading
+from audio_block import AudioBlock
+from audio_file_block import AudioFileBlockCache, AudioFileBlockLoader
+from audio_file_reader import AudioFileInfo
+from ..commons import SamplesProcessor
+
+_RenderBlock = None
+
+def _init_worker():
+    #the pool is forked from a process running the audio server, loader and
+    #read-ahead threads, whatever they held at that moment has to be renewed
+    AudioFileBlockCache.Lock = threading.RLock()
+    AudioFileBlockLoader.reset_after_fork()
+    AudioFileInfo.Lock = threading.Lock()
+    SamplesProcessor.KernelLock = threading.Lock()
+    _RenderBlock.reset_after_fork(set())
+
+def _render_segment(segment):
+    start_pos, frame_count = segment
+    return AudioOfflineRenderer.render_span(_RenderBlock, start_pos, frame_count)
+
+class AudioOfflineRenderer(object):
+    SegmentFrames = AudioBlock.FramesPerBuffer*256
+
+    def __init__(self, audio_block, frame_count, processes=None):
+        self.audio_block = audio_block
+        self.frame_count = int(frame_count)
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = max(processes, 1)
+
+    @staticmethod
+    def render_span(audio_block, start_pos, frame_count):
+        samples = AudioBlock.get_blank_data(frame_count)
+        audio_block.get_samples(
+            frame_count, start_from=start_pos, use_loop=False,
+            pausable=False, out=samples, offline=True)
+        return samples
+
+    def get_segment_list(self):
+        segments = []
+        for start_pos in xrange(0, self.frame_count, self.SegmentFrames):
+            segments.append((start_pos, min(self.frame_count-start_pos, self.SegmentFrames)))
+        return segments
+
+    def get_segments(self):
+        global _RenderBlock
+        segments = self.get_segment_list()
+        self.audio_block.load_samples()
+        if self.processes == 1 or len(segments)<=1:
+            for start_pos, frame_count in segments:
+                yield self.render_span(self.audio_block, start_pos, frame_count)
+            return
+
+        #workers are forked, so they inherit the block tree through this global
+        _RenderBlock = self.audio_block
+        pool = multiprocessing.Pool(self.processes, initializer=_init_worker)
+        try:
+            pending = []
+            max_pending = 2*self.processes
+            for segment in segments:
+                pending.append(pool.apply_async(_render_segment, (segment,)))
+                if len(pending)>=max_pending:
+                    yield pending.pop(0).get()
+            while pending:
+                yield pending.pop(0).get()
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _RenderBlock = None
@@ -33,11 +33,18 @@ class AudioSamplesBlock(AudioBlock):
             self.set_sample_count(self.samples.shape[0])
         self.inclusive_duration = self.samples.shape[0]
 
+    def reset_after_fork(self, reset_blocks):
+        super(AudioSamplesBlock, self).reset_after_fork(reset_blocks)
+        if not isinstance(self.samples, numpy.ndarray):
+            self.samples.reset_after_fork()
+
     def set_samples(self, samples):
         self.samples = samples
         self.readjust()
+        self.mark_content_changed()
 
-    def get_samples(self, frame_count, start_from=None, use_loop=True, loop=None):
+    def get_samples(self, frame_count, start_from=None, use_loop=True, loop=None,
+                          out=None, offline=False):
         if self.paused:
             return None
         if start_from is None:
@@ -49,62 +56,62 @@ class AudioSamplesBlock(AudioBlock):
             loop = self.loop
 
         audio_message = AudioMessage()
-        data = None
+        send_midi = self.midi_channel is not None and not offline
+        #a single reference is used throughout, the samples may be swapped meanwhile
+        samples = self.samples
+        sample_count = samples.shape[0]
+        #(offset in output, offset in samples, count)
+        segments = []
+        tile_indices = None
 
         if loop and loop != self.LOOP_NEVER_EVER and use_loop:
-            spread = frame_count
-            start_init_pos = start_pos
-            elapsed_pos = 0
-            while data is None or data.shape[0]<frame_count:
-                if loop == self.LOOP_STRETCH:
-                    if start_pos>=self.duration:
-                        break
-                    read_pos = start_pos%self.samples.shape[0]
-                else:
-                    start_pos %= self.duration
-                    read_pos = start_pos
-
-                if read_pos<self.inclusive_duration:
-                    if self.midi_channel is not None:
-                        if read_pos == 0:
-                            audio_message.midi_messages.append(
-                                self.new_midi_note_on_message(elapsed_pos))
-
-                    seg = self.samples[read_pos: read_pos+spread, :]
+            if loop == self.LOOP_STRETCH:
+                period = sample_count
+                end_pos = min(start_pos+frame_count, self.duration)
+            else:
+                period = self.duration
+                start_pos %= period
+                end_pos = start_pos+frame_count
+            readable_count = min(self.inclusive_duration, sample_count, period)
+
+            if end_pos>start_pos:
+                wrap_starts = self.get_wrap_starts(start_pos, end_pos, period)
+                seg_starts = numpy.maximum(wrap_starts, start_pos)
+                seg_ends = numpy.minimum(wrap_starts+readable_count, end_pos)
+                valid = seg_ends>seg_starts
+
+                if send_midi:
+                    self.append_loop_midi_messages(
+                        audio_message, start_pos, end_pos, wrap_starts,
+                        period, readable_count, loop)
+
+                if valid.sum()>2 and isinstance(samples, numpy.ndarray):
+                    tile_indices = numpy.arange(start_pos, end_pos)%period
                 else:
-                    read_count = min(self.duration-start_pos, spread)
-                    seg = numpy.zeros((read_count, self.ChannelCount), dtype=numpy.float32)
+                    for wrap_start, seg_start, seg_end in zip(
+                            wrap_starts[valid], seg_starts[valid], seg_ends[valid]):
+                        segments.append((int(seg_start-start_pos),
+                                         int(seg_start-wrap_start),
+                                         int(seg_end-seg_start)))
 
-                if data is None:
-                    data = seg
+                if loop == self.LOOP_STRETCH:
+                    start_pos = end_pos
                 else:
-                    data = numpy.append(data, seg, axis=0)
-
-                start_pos += seg.shape[0]
-                spread -= seg.shape[0]
-                elapsed_pos += seg.shape[0]
-
-                if self.midi_channel is not None:
-                    if start_pos%self.inclusive_duration ==0:
-                        audio_message.midi_messages.append(
-                            self.new_midi_note_off_message(elapsed_pos))
+                    start_pos = end_pos-((end_pos-1)//period)*period
 
-            if data is None:
-                data = numpy.zeros((frame_count, self.ChannelCount), dtype=numpy.float32)
             if start_from is None:
                 self.lock.acquire()
                 self.current_pos = start_pos
                 self.lock.release()
         else:
-            if self.midi_channel is not None and start_pos == 0:
+            if send_midi and start_pos == 0:
                 audio_message.midi_messages.append(self.new_midi_note_on_message(0))
-            if start_pos>=self.duration:
-                data = numpy.zeros((0, AudioBlock.ChannelCount), dtype=numpy.float32)
-            else:
-                data = self.samples[start_pos: start_pos+frame_count, :]
-            start_pos += data.shape[0]
-            if self.midi_channel is not None and start_pos >= self.duration:# and data.shape[0]>0:
-                audio_message.midi_messages.append(self.new_midi_note_off_message(data.shape[0]))
+            read_count = max(min(frame_count, self.duration-start_pos, sample_count-start_pos), 0)
+            if read_count>0:
+                segments.append((0, start_pos, read_count))
+            start_pos += read_count
+            if send_midi and start_pos >= self.duration:
+                audio_message.midi_messages.append(self.new_midi_note_off_message(read_count))
             if start_from is None:
                 self.lock.acquire()
                 self.current_pos = start_pos
@@ -112,13 +119,67 @@ class AudioSamplesBlock(AudioBlock):
                 if self.live_once and self.current_pos >= self.duration:
                     self.destroy()
 
-        if data.shape[0]<frame_count:
-            blank_shape = (frame_count - data.shape[0], AudioBlock.ChannelCount)
-            data = numpy.append(data, numpy.zeros(blank_shape, dtype=numpy.float32), axis=0)
+        if tile_indices is not None:
+            #many wraps fit in this buffer, so gather them all in one pass
+            if out is None:
+                data = self.get_blank_data(frame_count)
+            else:
+                data = out
+            tiled = samples.take(tile_indices, axis=0, mode="clip")
+            if readable_count<period:
+                tiled[tile_indices>=readable_count, :] = 0
+            data[:tiled.shape[0], :] += tiled
+        elif out is None and len(segments) == 1 and segments[0][2] == frame_count:
+            #whole buffer comes from one stretch of samples, so hand out a view
+            read_pos = segments[0][1]
+            data = self.read_samples(samples, read_pos, read_pos+frame_count, offline)
+        else:
+            if out is None:
+                data = self.get_blank_data(frame_count)
+            else:
+                data = out
+            for data_pos, read_pos, read_count in segments:
+                data[data_pos: data_pos+read_count, :] += \
+                        self.read_samples(samples, read_pos, read_pos+read_count, offline)
         audio_message.samples = data
-        audio_message.block_positions.append((self, start_pos))
         return audio_message
 
+    @staticmethod
+    def read_samples(samples, start, end, offline):
+        if isinstance(samples, numpy.ndarray):
+            return samples[start:end, :]
+        #streamed samples only wait for decoding when rendering offline
+        return samples.read(start, end, blocking=offline)
+
+    def append_loop_midi_messages(self, audio_message, start_pos, end_pos,
+                                        wrap_starts, period, readable_count, loop):
+        #(delay, is_note_on); note-off sorts before a note-on at the same delay
+        events = []
+        if readable_count>0:
+            for wrap_start in wrap_starts[wrap_starts>=start_pos]:
+                events.append((int(wrap_start-start_pos), True))
+
+        #reads end at the readable part, the loop period and the buffer end
+        seg_ends = set([end_pos])
+        for seg_end in numpy.concatenate(
+                        (wrap_starts+readable_count, wrap_starts+period)):
+            if start_pos<seg_end<end_pos:
+                seg_ends.add(int(seg_end))
+        if self.inclusive_duration>0:
+            for seg_end in seg_ends:
+                if loop == self.LOOP_STRETCH:
+                    loop_pos = seg_end
+                else:
+                    loop_pos = seg_end-((seg_end-1)//period)*period
+                if loop_pos%self.inclusive_duration == 0:
+                    events.append((int(seg_end-start_pos), False))
+
+        for delay, is_note_on in sorted(events):
+            if is_note_on:
+                audio_message.midi_messages.append(self.new_midi_note_on_message(delay))
+            else:
+                audio_message.midi_messages.append(self.new_midi_note_off_message(delay))
+
     def save_to_file(self, filename):
         scipy.io.wavfile.write(filename, int(AudioBlock.SampleRate), self.samples)
         return
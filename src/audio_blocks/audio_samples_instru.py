@@ -1,5 +1,5 @@
 from audio_instru import AudioInstru
-from ..commons import MusicNote, SamplesProcessor
+from ..commons import MusicNote
 from audio_samples_block import AudioSamplesBlock
 
 class AudioSamplesInstru(AudioInstru):
@@ -8,6 +8,7 @@ class AudioSamplesInstru(AudioInstru):
         self.samples = samples
         self.base_note = MusicNote.get_note(base_note)
         self.notes_samples = dict()
+        self.notes_version = self.content_version
 
     def get_xml_element(self):
         elm = super(AudioSamplesInstru, self).get_xml_element()
@@ -21,12 +22,15 @@ class AudioSamplesInstru(AudioInstru):
     def get_samples_for(self, note):
         if isinstance(note, str):
             note = MusicNote.get_note(note)
+        if self.notes_version != self.content_version:
+            self.notes_samples.clear()
+            self.notes_version = self.content_version
         if note.name not in self.notes_samples:
             factor = note.frequency/self.base_note.frequency
             if factor == 1:
                 samples = self.samples.copy()
             else:
-                samples = SamplesProcessor.speed_up(self.samples, factor)
+                samples = self.shift_note_samples(self.samples, factor)
             self.notes_samples[note.name] = samples
         else:
             samples = self.notes_samples[note.name]
@@ -41,14 +45,13 @@ class AudioSamplesInstru(AudioInstru):
         return note_block
 
     def readjust_blocks(self):
-        for note_name in self.notes_samples:
-            del self.notes_samples[note_name]
-            self.notes_samples[note_name] = self.get_samples_for(note_name)
+        self.mark_content_changed()
         for block in self.blocks:
             if isinstance(block, AudioSamplesBlock):
                 block.set_samples(self.get_samples_for(block.music_note))
             else:
                 block.readjust()
+        self.recalculate_owner_durations()
 
     def refill_block(self, block):
         block.samples = self.get_samples_for(block.music_note)
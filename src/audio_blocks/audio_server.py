@@ -1,45 +1,224 @@
 import pyaudio
-import Queue
 import numpy
 import threading
 import time
 from audio_group import AudioGroup
 from audio_block import AudioBlock
+from ..commons import MidiMessage
 import mido
+import bisect
+import heapq
+import logging
+import os
+import select
+import fcntl
+
+logger = logging.getLogger(__name__)
 
 class MidiThread(threading.Thread):
     def __init__(self):
         super(MidiThread, self).__init__()
-        self.midi_queue = Queue.PriorityQueue()
+        self.midi_events = []
+        self.event_count = 0
+        self.lock = threading.Lock()
+        #a timed Condition.wait polls in python2, select on a pipe wakes at once
+        self.wake_read, self.wake_write = os.pipe()
+        fcntl.fcntl(self.wake_write, fcntl.F_SETFL,
+                    fcntl.fcntl(self.wake_write, fcntl.F_GETFL)|os.O_NONBLOCK)
+        self.clock = time.time
         self.midi_output = mido.open_output(name="BlockAudio", virtual=True)
         self.should_exit = False
         self.paused = False
         self.start()
 
+    def wake(self):
+        try:
+            os.write(self.wake_write, "w")
+        except OSError:
+            #the pipe is full, so a wakeup is already pending
+            pass
+
+    def set_clock(self, clock):
+        self.lock.acquire()
+        if self.midi_events:
+            #pending events keep their distance from now on the new clock
+            shift = clock()-self.clock()
+            #a uniform shift keeps the heap order
+            self.midi_events = [(at+shift, count, midi_bytes) \
+                                    for at, count, midi_bytes in self.midi_events]
+        self.clock = clock
+        self.lock.release()
+        self.wake()
+
+    def schedule(self, events):
+        if not events:
+            return
+        self.lock.acquire()
+        first_at = self.midi_events[0][0] if self.midi_events else None
+        for at, midi_bytes in events:
+            #the counter keeps events of equal time in their arrival order
+            self.event_count += 1
+            heapq.heappush(self.midi_events, (at, self.event_count, midi_bytes))
+        is_earlier = first_at is None or self.midi_events[0][0]<first_at
+        self.lock.release()
+        if is_earlier:
+            self.wake()
+
     def run(self):
-        item = None
-        while not self.should_exit:
-            if not self.paused:
-                if item is None:
-                    try:
-                        item = self.midi_queue.get(block=False)
-                    except Queue.Empty:
-                        item = None
-                if item:
-                    if item[0]<=time.time():
-                        self.midi_output.send(item[1])
-                        item = None
-            time.sleep(.01)
+        while True:
+            self.lock.acquire()
+            if self.should_exit:
+                self.lock.release()
+                break
+            timeout = None
+            due_events = []
+            if not self.paused and self.midi_events:
+                now = self.clock()
+                while self.midi_events and self.midi_events[0][0]<=now:
+                    due_events.append(heapq.heappop(self.midi_events)[2])
+                if self.midi_events:
+                    timeout = self.midi_events[0][0]-now
+            self.lock.release()
+
+            if due_events:
+                for midi_bytes in due_events:
+                    mido_message = MidiMessage.bytes_to_mido(midi_bytes)
+                    if mido_message is None:
+                        logger.warning("skipped invalid midi bytes %r", midi_bytes)
+                        continue
+                    self.midi_output.send(mido_message)
+                continue
+
+            if select.select([self.wake_read], [], [], timeout)[0]:
+                os.read(self.wake_read, 4096)
 
     def close(self):
+        self.lock.acquire()
         self.should_exit = True
+        self.lock.release()
+        self.wake()
         if self.is_alive():
             self.join()
+        os.close(self.wake_read)
+        os.close(self.wake_write)
+
+class AudioRingBuffer(object):
+    def __init__(self, frame_count, capacity):
+        self.capacity = max(int(capacity), 1)
+        self.slots = []
+        for i in xrange(self.capacity):
+            self.slots.append(AudioBlock.get_blank_data(frame_count))
+        self.messages = [None]*self.capacity
+        #each counter is only advanced by one thread, so no lock is needed
+        self.write_count = 0
+        self.read_count = 0
+
+    def get_fill_count(self):
+        return self.write_count-self.read_count
+
+    def is_full(self):
+        return self.get_fill_count()>=self.capacity
+
+    def get_write_slot(self):
+        slot = self.slots[self.write_count%self.capacity]
+        slot.fill(0)
+        return slot
+
+    def commit_write(self, message):
+        self.messages[self.write_count%self.capacity] = message
+        self.write_count += 1
+
+    def read(self):
+        if self.read_count>=self.write_count:
+            return None
+        index = self.read_count%self.capacity
+        return self.slots[index], self.messages[index]
+
+    def commit_read(self):
+        self.messages[self.read_count%self.capacity] = None
+        self.read_count += 1
+
+class AudioServerStats(object):
+    RenderLoadEdges = (.25, .5, .75, 1., 1.5, 2.)
+    StatusFlags = (
+        ("output_underflow", pyaudio.paOutputUnderflow),
+        ("output_overflow", pyaudio.paOutputOverflow),
+        ("priming_output", pyaudio.paPrimingOutput),
+    )
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.callback_count = 0
+        self.underrun_count = 0
+        self.status_counts = dict()
+        for flag_name, flag in self.StatusFlags:
+            self.status_counts[flag_name] = 0
+        self.queue_depth_counts = dict()
+        self.render_count = 0
+        self.deadline_miss_count = 0
+        self.max_render_load = 0.
+        self.render_load_counts = [0]*(len(self.RenderLoadEdges)+1)
+
+    def add_callback(self, status, queue_depth):
+        self.callback_count += 1
+        if status:
+            for flag_name, flag in self.StatusFlags:
+                if status & flag:
+                    self.status_counts[flag_name] += 1
+        if queue_depth is not None:
+            self.queue_depth_counts[queue_depth] = \
+                self.queue_depth_counts.get(queue_depth, 0) + 1
+
+    def add_underrun(self):
+        self.underrun_count += 1
+
+    def add_render_time(self, render_time, frame_count):
+        #load is the render time as a fraction of the time the buffer plays for
+        render_load = render_time*AudioBlock.SampleRate/frame_count
+        self.render_count += 1
+        if render_load>1:
+            self.deadline_miss_count += 1
+        if render_load>self.max_render_load:
+            self.max_render_load = render_load
+        self.render_load_counts[bisect.bisect_left(self.RenderLoadEdges, render_load)] += 1
+
+    def get_stats(self):
+        render_load_histogram = []
+        for i in xrange(len(self.render_load_counts)):
+            if i<len(self.RenderLoadEdges):
+                edge = self.RenderLoadEdges[i]
+            else:
+                edge = float("inf")
+            render_load_histogram.append((edge, self.render_load_counts[i]))
+        return dict(
+            callbacks=self.callback_count,
+            underruns=self.underrun_count,
+            status_flags=dict(self.status_counts),
+            queue_depths=dict(self.queue_depth_counts),
+            renders=self.render_count,
+            deadline_misses=self.deadline_miss_count,
+            max_render_load=self.max_render_load,
+            render_load_histogram=render_load_histogram)
+
+    def get_summary_text(self):
+        return "callbacks={0} underruns={1} deadline_misses={2}/{3} " \
+               "max_load={4:.2f} status={5} depths={6}".format(
+                    self.callback_count, self.underrun_count,
+                    self.deadline_miss_count, self.render_count,
+                    self.max_render_load, self.status_counts,
+                    sorted(self.queue_depth_counts.items()))
 
 class AudioServer(threading.Thread):
     PaManager = None
     Servers = []
     DefaultBufferMult = .99
+    DefaultBuffersAhead = 3
+    LowLatencyFrameCounts = (64, 128, 256)
+    DefaultLowLatencyFrames = 128
+    DeadlineFraction = .75
+    MaxMissedDeadlines = 3
 
     @staticmethod
     def get_default():
@@ -56,7 +235,10 @@ class AudioServer(threading.Thread):
             server.close()
         del AudioServer.Servers[:]
 
-    def __init__(self, buffer_mult=DefaultBufferMult, host_api_name="jack"):
+    def __init__(self, buffer_mult=DefaultBufferMult, host_api_name="jack",
+                       buffers_ahead=DefaultBuffersAhead,
+                       low_latency=False, frames_per_buffer=None,
+                       stats_log_period=None):
         super(AudioServer, self).__init__()
         self.midi_thread = MidiThread()
         self.pa_manager = pyaudio.PyAudio()
@@ -72,13 +254,29 @@ class AudioServer(threading.Thread):
                     continue
                 self.output_device_index = device_info["index"]
 
-        self.audio_queue = Queue.Queue()
-        self.block_positions_queue = Queue.Queue()
+        if frames_per_buffer is None:
+            if low_latency:
+                frames_per_buffer = self.DefaultLowLatencyFrames
+            else:
+                frames_per_buffer = AudioBlock.FramesPerBuffer
+        self.low_latency = low_latency
+        self.frames_per_buffer = int(frames_per_buffer)
+        #the requested mode, applied by the render thread while the stream is closed
+        self.stream_mode = (self.low_latency, self.frames_per_buffer)
+        self.lock = threading.Lock()
+        self.buffers_ahead = buffers_ahead
+        self.ring_buffer = None
+        self.render_event = threading.Event()
+        self.subscribed_blocks = ()
+        self.playhead_table = None
         self.audio_group = AudioGroup()
         self.should_exit = False
         self.paused = False
         self.set_buffer_mult(buffer_mult)
         self.stream = None
+        self.stream_reset = False
+        self.stats = AudioServerStats()
+        self.stats_log_period = stats_log_period
         AudioServer.Servers.append(self)
         self.start()
 
@@ -87,84 +285,208 @@ class AudioServer(threading.Thread):
         if block:
             block.play()
             self.audio_group.play()
+        self.render_event.set()
 
     def add_block(self, block):
         self.audio_group.add_block(block)
 
     def remove_block(self, block):
         self.audio_group.remove_block(block)
+        self.unsubscribe_block(block)
+
+    def subscribe_block(self, block):
+        #swapped as a whole, the render side only ever reads the tuple
+        if block not in self.subscribed_blocks:
+            self.subscribed_blocks = self.subscribed_blocks + (block,)
+
+    def unsubscribe_block(self, block):
+        if block in self.subscribed_blocks:
+            self.subscribed_blocks = tuple(
+                subscribed_block for subscribed_block in self.subscribed_blocks \
+                                 if subscribed_block is not block)
+
+    def get_playheads(self):
+        subscribed_blocks = self.subscribed_blocks
+        if not subscribed_blocks:
+            return None
+        return tuple((block, block.current_pos) for block in subscribed_blocks)
+
+    def update_play_positions(self):
+        playhead_table = self.playhead_table
+        if not playhead_table:
+            return
+        ends_at, playheads = playhead_table
+        #the table is published ahead of time, so step back by what is still to be played
+        lag = int(max(ends_at-self.stream.get_time(), 0)*AudioBlock.SampleRate)
+        for block, pos in playheads:
+            block.play_pos = max(pos-lag, 0)
 
     def get_latency(self):
         return self.stream.get_output_latency()
 
+    def get_stats(self):
+        stats = self.stats.get_stats()
+        stats["low_latency"] = self.low_latency
+        stats["frames_per_buffer"] = self.frames_per_buffer
+        if self.ring_buffer:
+            stats["queue_depth"] = self.ring_buffer.get_fill_count()
+        return stats
+
+    def reset_stats(self):
+        self.stats.reset()
+
+    def set_stats_log_period(self, period):
+        self.stats_log_period = period
+
     def set_buffer_mult(self, mult):
         self.buffer_mult = mult
-        buffer_time = AudioBlock.FramesPerBuffer/float(AudioBlock.SampleRate)
+        buffer_time = self.frames_per_buffer/float(AudioBlock.SampleRate)
         self.period = max(buffer_time*self.buffer_mult, .001)
 
-    def run(self):
+    def set_low_latency(self, low_latency, frames_per_buffer=None):
+        if frames_per_buffer is None:
+            if low_latency:
+                frames_per_buffer = self.DefaultLowLatencyFrames
+            else:
+                frames_per_buffer = AudioBlock.FramesPerBuffer
+        self.lock.acquire()
+        self.stream_mode = (low_latency, int(frames_per_buffer))
+        self.stream_reset = True
+        self.lock.release()
+        #the stream can only be reopened from the render thread
+        self.render_event.set()
+
+    def set_frames_per_buffer(self, frames_per_buffer):
+        self.lock.acquire()
+        self.stream_mode = (self.stream_mode[0], int(frames_per_buffer))
+        self.stream_reset = True
+        self.lock.release()
+        self.render_event.set()
+
+    def apply_stream_mode(self):
+        #switching while the stream is closed keeps the callback and the
+        #render thread from ever rendering at the same time
+        self.lock.acquire()
+        self.low_latency, self.frames_per_buffer = self.stream_mode
+        self.stream_reset = False
+        self.lock.release()
+        self.set_buffer_mult(self.buffer_mult)
+
+    def open_stream(self):
+        self.ring_buffer = AudioRingBuffer(self.frames_per_buffer, self.buffers_ahead)
+        self.blank_data = AudioBlock.get_blank_data(self.frames_per_buffer)
+        self.direct_buffer = AudioBlock.get_blank_data(self.frames_per_buffer)
+        self.missed_deadline_count = 0
         self.stream = self.pa_manager.open(
                 format=pyaudio.paFloat32,
                 channels=AudioBlock.ChannelCount,
                 rate= int(AudioBlock.SampleRate),
                 output=True,
-                frames_per_buffer = AudioBlock.FramesPerBuffer,
+                frames_per_buffer = self.frames_per_buffer,
                 stream_callback=self.stream_callback,
                 output_device_index=self.output_device_index)
-        self.audio_group.play()
-        last_time = 0
-        block_positions = None
-        played_at = None
-        while not self.should_exit:
-            if block_positions is None:
-                try:
-                    block_positions, played_at = self.block_positions_queue.get(block=False)
-                except Queue.Empty:
-                    pass
-            if block_positions and played_at<=time.time():
-                for block, pos in block_positions:
-                    block.play_pos = pos
-                block_positions = None
-
-            if (time.time()-last_time)>self.period and not self.paused:
-                audio_message = self.audio_group.get_samples(AudioBlock.FramesPerBuffer)
-                if audio_message is not None:
-                    if audio_message.samples is not None:
-                        self.audio_queue.put(audio_message, block=True)
-
-            last_time = time.time()
-            time.sleep(self.period)
+        self.midi_thread.set_clock(self.stream.get_time)
+
+    def close_stream(self):
+        self.midi_thread.set_clock(time.time)
         self.stream.stop_stream()
         self.stream.close()
 
-    def stream_callback(self, in_data, frame_count, time_info, status):
-        if self.paused:
-            data = self.audio_group.blank_data.copy()
+    def run(self):
+        self.open_stream()
+        self.audio_group.play()
+        last_log_at = time.time()
+        while not self.should_exit:
+            self.update_play_positions()
+
+            if self.stats_log_period and time.time()-last_log_at>=self.stats_log_period:
+                logger.info(self.stats.get_summary_text())
+                last_log_at = time.time()
+
+            if self.stream_reset:
+                self.close_stream()
+                self.apply_stream_mode()
+                self.open_stream()
+
+            #cleared before filling, so a wakeup from the callback is never lost
+            self.render_event.clear()
+            while not self.paused and not self.low_latency and not self.should_exit and \
+                    not self.ring_buffer.is_full():
+                self.render_buffer()
+            self.render_event.wait(self.period)
+        self.close_stream()
+
+    def render_buffer(self):
+        render_start = time.time()
+        slot = self.ring_buffer.get_write_slot()
+        audio_message = self.audio_group.get_samples(slot.shape[0], out=slot)
+        self.ring_buffer.commit_write((audio_message, self.get_playheads()))
+        self.stats.add_render_time(time.time()-render_start, slot.shape[0])
+
+    def render_direct(self, frame_count, time_info):
+        render_start = time.time()
+        self.direct_buffer.fill(0)
+        audio_message = self.audio_group.get_samples(frame_count, out=self.direct_buffer)
+        data = self.direct_buffer.tostring()
+        self.dispatch_message(audio_message, self.get_playheads(), frame_count, time_info)
+
+        render_time = time.time()-render_start
+        self.stats.add_render_time(render_time, frame_count)
+        deadline = frame_count*self.DeadlineFraction/AudioBlock.SampleRate
+        if render_time>deadline:
+            self.missed_deadline_count += 1
+            if self.missed_deadline_count == self.MaxMissedDeadlines:
+                #fall back to the queued mode with normal buffers, the callback
+                #keeps rendering until the render thread reopens the stream
+                self.set_low_latency(False)
         else:
-            try:
-                audio_message = self.audio_queue.get(block=False)
-                data = audio_message.samples
-                if data is None:
-                    data = self.audio_group.blank_data.copy()
-                if audio_message.midi_messages:
-                    for midi_message in audio_message.midi_messages:
-                        self.midi_thread.midi_queue.put((
-                            time.time()+(midi_message.delay*1./AudioBlock.SampleRate),
-                            midi_message.mido_message
-                        ))
-                if audio_message.block_positions:
-                    played_at = time_info["output_buffer_dac_time"]+time.time()
-                    self.block_positions_queue.put(
-                        (audio_message.block_positions, played_at))
-
-                self.audio_queue.task_done()
-            except Queue.Empty:
-                data = self.audio_group.blank_data.copy()
+            self.missed_deadline_count = 0
+        return data
+
+    def stream_callback(self, in_data, frame_count, time_info, status):
+        if self.paused or frame_count != self.frames_per_buffer:
+            self.stats.add_callback(status, None)
+            return (self.blank_data.tostring(), pyaudio.paContinue)
+
+        if self.low_latency:
+            self.stats.add_callback(status, None)
+            return (self.render_direct(frame_count, time_info), pyaudio.paContinue)
+
+        self.stats.add_callback(status, self.ring_buffer.get_fill_count())
+        ring_item = self.ring_buffer.read()
+        if ring_item is None:
+            self.stats.add_underrun()
+            return (self.blank_data.tostring(), pyaudio.paContinue)
+
+        slot, (audio_message, playheads) = ring_item
+        #copied out before the slot is handed back to the render thread
+        data = slot.tostring()
+        self.dispatch_message(audio_message, playheads, frame_count, time_info)
+        self.ring_buffer.commit_read()
+        self.render_event.set()
         return (data, pyaudio.paContinue)
 
+    def dispatch_message(self, audio_message, playheads, frame_count, time_info):
+        #scheduled on the stream clock, at the time this buffer reaches the dac
+        dac_time = time_info["output_buffer_dac_time"]
+        if not dac_time:
+            dac_time = self.stream.get_time()
+        if playheads:
+            self.playhead_table = (dac_time+frame_count*1./AudioBlock.SampleRate, playheads)
+        if audio_message is not None:
+            if audio_message.midi_messages:
+                midi_events = []
+                for midi_message in audio_message.midi_messages:
+                    midi_events.append((
+                        dac_time+(midi_message.delay*1./AudioBlock.SampleRate),
+                        midi_message.midi_bytes
+                    ))
+                self.midi_thread.schedule(midi_events)
+
     def close(self):
         self.midi_thread.close()
         self.should_exit = True
+        self.render_event.set()
         if self.is_alive():
             self.join()
         AudioServer.Servers.remove(self)
@@ -1,25 +1,156 @@
 from audio_block import AudioBlock, AudioBlockTime
 import threading
-import time
 import numpy
 from ..commons import AudioMessage
 from xml.etree.ElementTree import Element as XmlElement
-import moviepy.editor
-from ..commons import WaveFileWriter
+import moviepy.config
+from ..commons import WaveFileWriter, FFmpegAudioWriter
+from audio_offline_renderer import AudioOfflineRenderer
 import os
+import bisect
+
+class TimedBlockIndex(object):
+    #blocks longer than this many times the median length are always checked
+    LongBlockFactor = 8
+
+    def __init__(self):
+        self.version = 0
+        self.snapshot = ((), (), (), (), 0, 0)
+
+    def rebuild(self, blocks):
+        entries = []
+        infinite_entries = []
+        end_pos = 0
+        for i in xrange(len(blocks)):
+            block = blocks[i]
+            block_start_pos = block.start_time.sample_count
+            block_end_pos = block_start_pos+block.duration
+            if block_end_pos>end_pos:
+                end_pos = block_end_pos
+            if block.loop == AudioBlock.LOOP_INFINITE:
+                infinite_entries.append((i, block_start_pos, block))
+            else:
+                entries.append((block_start_pos, block_end_pos, i, block))
+
+        #a few long blocks, like pads or backing files, would otherwise widen
+        #every lookup to the whole group, so they are kept aside
+        long_entries = []
+        if entries:
+            lengths = sorted(entry[1]-entry[0] for entry in entries)
+            long_length = max(lengths[len(lengths)//2]*self.LongBlockFactor, 1)
+            short_entries = []
+            for entry in entries:
+                if entry[1]-entry[0]>long_length:
+                    long_entries.append(entry)
+                else:
+                    short_entries.append(entry)
+            entries = short_entries
+        entries.sort(key=lambda entry: entry[0])
+
+        starts = []
+        max_length = 0
+        for block_start_pos, block_end_pos, i, block in entries:
+            if block_end_pos-block_start_pos>max_length:
+                max_length = block_end_pos-block_start_pos
+            starts.append(block_start_pos)
+        #published with a single assignment so that readers never need a lock
+        self.snapshot = (tuple(starts), tuple(entries), tuple(long_entries),
+                         tuple(infinite_entries), end_pos, max_length)
+        self.version += 1
+
+    def get_end_pos(self):
+        return self.snapshot[4]
+
+    def get_blocks_within(self, start_pos, end_pos):
+        starts, entries, long_entries, infinite_entries, last_end_pos, max_length = \
+                self.snapshot
+        #no indexed block is longer than max_length, so every entry before lo ends by start_pos
+        lo = bisect.bisect_right(starts, start_pos-max_length)
+        hi = bisect.bisect_left(starts, end_pos)
+        found = []
+        for j in xrange(lo, hi):
+            block_start_pos, block_end_pos, i, block = entries[j]
+            if block_end_pos>start_pos:
+                found.append((i, block_start_pos, block))
+        for block_start_pos, block_end_pos, i, block in long_entries:
+            if block_start_pos<end_pos and block_end_pos>start_pos:
+                found.append((i, block_start_pos, block))
+        for entry in infinite_entries:
+            if entry[1]<end_pos:
+                found.append(entry)
+        found.sort(key=lambda entry: entry[0])
+        return found
+
+class TimedRenderCache(object):
+    ChunkFrames = AudioBlock.FramesPerBuffer
+    MaxFrames = int(AudioBlock.SampleRate*8)
+
+    def __init__(self):
+        self.state = None
+        #playback, previews and offline renders may fill the same chunks
+        self.lock = threading.Lock()
+
+    def get_state(self, group):
+        #version is read before the block index, so a stale fill is never kept,
+        #linked copies share the cache, so it follows the version of the original
+        content_version = (group.linked_to or group).content_version
+        state = self.state
+        if state is None or state[0] != content_version:
+            frame_count = group.block_index.get_end_pos()
+            if frame_count<=0 or frame_count>self.MaxFrames:
+                samples = None
+                filled = None
+            else:
+                samples = AudioBlock.get_blank_data(frame_count)
+                filled = numpy.zeros(
+                    (frame_count+self.ChunkFrames-1)//self.ChunkFrames, dtype=numpy.bool_)
+            state = (content_version, samples, filled, group.has_midi_content())
+            self.state = state
+        return state
+
+    def mix_into(self, group, start_pos, frame_count, out, offline):
+        self.lock.acquire()
+        try:
+            content_version, samples, filled, has_midi = self.get_state(group)
+            #midi events can not be replayed from the cache
+            if samples is None or (has_midi and not offline):
+                return 0
+            if start_pos>=samples.shape[0]:
+                return 0
+            end_pos = min(start_pos+frame_count, samples.shape[0])
+            for chunk in xrange(start_pos//self.ChunkFrames, (end_pos-1)//self.ChunkFrames+1):
+                if filled[chunk]:
+                    continue
+                chunk_start = chunk*self.ChunkFrames
+                chunk_count = min(self.ChunkFrames, samples.shape[0]-chunk_start)
+                #a chunk rendered while file samples are still loading would keep the silence,
+                #so the rest of the span is left to the caller to render directly
+                if not group.are_samples_loaded(chunk_start, chunk_start+chunk_count):
+                    end_pos = max(chunk_start, start_pos)
+                    break
+                group.render_blocks(
+                    chunk_start, chunk_count,
+                    samples[chunk_start:chunk_start+chunk_count, :], AudioMessage(), offline)
+                filled[chunk] = True
+        finally:
+            self.lock.release()
+        #filled chunks are never written again, so they are read outside the lock
+        out[:end_pos-start_pos, :] += samples[start_pos:end_pos, :]
+        return end_pos-start_pos
 
 class AudioTimedGroup(AudioBlock):
     TYPE_NAME = "tgrp"
+    PrefetchSeconds = 5.
 
-    blank_data = None
     def __init__(self):
         super(AudioTimedGroup, self).__init__()
         self.blocks = []
         self.linked_to = None
         self.linked_copies = None
         self.lock = threading.RLock()
-        if AudioTimedGroup.blank_data is None:
-            AudioTimedGroup.blank_data = self.get_blank_data(AudioBlock.FramesPerBuffer)
+        self.block_index = TimedBlockIndex()
+        self.render_cache = TimedRenderCache()
+        self.prefetch_range = None
 
     def copy(self, linked=False):
         if self.linked_to:
@@ -35,9 +166,13 @@ class AudioTimedGroup(AudioBlock):
             newob.linked_to = self
             newob.blocks = self.blocks
             newob.lock = self.lock
+            newob.block_index = self.block_index
+            newob.render_cache = self.render_cache
+            newob.content_version = self.content_version
         else:
             for block in self.blocks:
                 newob.blocks.append(block.copy())
+            newob.publish_blocks()
         return newob
 
     @classmethod
@@ -51,6 +186,9 @@ class AudioTimedGroup(AudioBlock):
             linked_to.linked_copies.append(newob)
             newob.inclusive_duration = linked_to.inclusive_duration
             newob.blocks = linked_to.blocks
+            newob.block_index = linked_to.block_index
+            newob.render_cache = linked_to.render_cache
+            newob.content_version = linked_to.content_version
         else:
             newob.blocks.extend(blocks)
             for block in blocks:
@@ -111,6 +249,7 @@ class AudioTimedGroup(AudioBlock):
         if block not in self.blocks:
             self.blocks.append(block)
             block.set_owner(self)
+            self.publish_blocks()
 
     def remove_block(self, block):
         self.lock.acquire()
@@ -161,40 +300,66 @@ class AudioTimedGroup(AudioBlock):
         self.lock.release()
         self.calculate_duration()
 
-    def calculate_duration(self):
+    def set_block_duration_value(self, block, value, beat):
         self.lock.acquire()
-        block_count = len(self.blocks)
+        block.set_duration_value(value, beat)
         self.lock.release()
+        self.calculate_duration()
 
-        duration = 0
-        for i in xrange(block_count):
-            self.lock.acquire()
-            if i<len(self.blocks):
-                block = self.blocks[i]
-                block_start_pos = block.start_time.sample_count
-            else:
-                block = None
-            self.lock.release()
+    def set_block_loop(self, block, loop):
+        self.lock.acquire()
+        block.set_loop(loop)
+        self.lock.release()
+        self.calculate_duration()
 
-            if not block:
-                break
+    def set_block_note(self, block, note):
+        block.set_note(note)
+        self.calculate_duration()
 
-            end_at = block_start_pos+block.duration
-            if end_at>duration:
-                duration = end_at
+    def publish_blocks(self):
+        self.lock.acquire()
+        blocks = tuple(self.blocks)
+        self.lock.release()
+        self.block_index.rebuild(blocks)
+        self.mark_content_changed()
+
+    def has_midi_content(self):
+        for i, block_start_pos, block in \
+                self.block_index.get_blocks_within(0, self.block_index.get_end_pos()):
+            if block.has_midi_content():
+                return True
+        return False
+
+    def mark_content_changed(self):
+        content_version = self.new_content_version()
+        linked_group = self.linked_to or self
+        linked_groups = [linked_group]
+        if linked_group.linked_copies:
+            linked_groups.extend(linked_group.linked_copies)
+        for linked_group in linked_groups:
+            linked_group.content_version = content_version
+        for linked_group in linked_groups:
+            if linked_group.owner:
+                linked_group.owner.mark_content_changed()
+
+    def calculate_duration(self):
+        self.publish_blocks()
+        duration = self.block_index.get_end_pos()
+
+        old_duration = self.duration
         self.inclusive_duration = duration
         super(AudioTimedGroup, self).calculate_duration()
+        if self.duration != old_duration and isinstance(self.owner, AudioTimedGroup):
+            self.owner.calculate_duration()
 
         if self.linked_copies:
             for linked_block in self.linked_copies:
                 linked_block.inclusive_duration = self.inclusive_duration
 
-    def get_samples(self, frame_count, start_from=None, use_loop=True, loop=None, pausable=True):
+    def get_samples(self, frame_count, start_from=None, use_loop=True, loop=None,
+                          pausable=True, out=None, offline=False):
         if self.paused and pausable:
             return None
-        self.lock.acquire()
-        block_count = len(self.blocks)
-        self.lock.release()
         if start_from is None:
             start_pos = self.current_pos
         else:
@@ -205,119 +370,92 @@ class AudioTimedGroup(AudioBlock):
             full_duration = self.inclusive_duration
         else:
             full_duration = self.duration
+        if loop == self.LOOP_INFINITE:
+            full_duration = self.duration
+
+        if start_from is None and not offline:
+            self.prefetch_ahead(start_pos, loop, full_duration)
+
+        if out is None:
+            out = self.get_blank_data(frame_count)
 
         audio_message = AudioMessage()
         if loop and use_loop:
-            data = None
-            spread = frame_count
-            data_count = 0
-            while data is None or data.shape[0]<frame_count:
-                if loop == self.LOOP_STRETCH:
-                    if start_pos>=self.duration:
-                        break
-                    read_pos = start_pos%full_duration
-                else:
-                    start_pos %= full_duration
-                    read_pos = start_pos
+            if loop == self.LOOP_STRETCH:
+                end_pos = min(start_pos+frame_count, self.duration)
+            elif full_duration>0:
+                start_pos %= full_duration
+                end_pos = start_pos+frame_count
+            else:
+                end_pos = start_pos
+
+            if full_duration>0 and end_pos>start_pos:
+                for wrap_start in self.get_wrap_starts(start_pos, end_pos, full_duration):
+                    seg_start = max(wrap_start, start_pos)
+                    seg_end = min(wrap_start+full_duration, end_pos)
+                    data_pos = int(seg_start-start_pos)
+                    read_count = int(seg_end-seg_start)
+                    midi_count = len(audio_message.midi_messages)
+                    self.mix_blocks(
+                        int(seg_start-wrap_start), read_count,
+                        out[data_pos:data_pos+read_count, :], audio_message, offline)
+                    for midi_message in audio_message.midi_messages[midi_count:]:
+                        midi_message.increase_delay(data_pos)
 
-                if read_pos+spread>full_duration:
-                    read_count = full_duration-read_pos
-                else:
-                    read_count = spread
-                seg_message = self.get_samples(read_count, start_from=read_pos, use_loop=False)
-                if seg_message is None:
-                    continue
-                if seg_message.midi_messages:
-                    for midi_message in seg_message.midi_messages:
-                        midi_message.increase_delay(data_count)
-                    audio_message.midi_messages.extend(seg_message.midi_messages)
-                if seg_message.block_positions:
-                    audio_message.block_positions.extend(seg_message.block_positions)
-
-                seg_samples = seg_message.samples
-                if data is None:
-                    data = seg_samples
+                if loop == self.LOOP_STRETCH:
+                    start_pos = end_pos
                 else:
-                    data = numpy.append(data, seg_samples, axis=0)
-                start_pos += seg_samples.shape[0]
-                data_count += seg_samples.shape[0]
-                spread -= seg_samples.shape[0]
+                    start_pos = end_pos-((end_pos-1)//full_duration)*full_duration
 
             if start_from is None:
                 self.current_pos = start_pos
 
-            if data is None:
-                data = self.blank_data[:frame_count, :]
-            elif data.shape[0]<frame_count:
-                blank_shape = (frame_count - data.shape[0], AudioBlock.ChannelCount)
-                data = numpy.append(data, numpy.zeros(blank_shape, dtype=numpy.float32), axis=0)
-
-            audio_message.block_positions.append([self, start_pos])
-            audio_message.samples = data
+            audio_message.samples = out
             return audio_message
 
-        samples = None
-        for i in xrange(block_count):
-            block_samples = None
-            self.lock.acquire()
-            if i<len(self.blocks):
-                block = self.blocks[i]
-                block_start_pos = block.start_time.sample_count
-            else:
-                block = None
-            self.lock.release()
+        #children may run past a shortened group, they are cut at its duration
+        read_count = max(min(frame_count, self.duration-start_pos), 0)
+        if read_count>0:
+            self.mix_blocks(start_pos, read_count, out[:read_count, :], audio_message, offline)
+        start_pos += frame_count
 
-            if not block:
-                break
-            if start_pos+frame_count<block_start_pos:
-                continue
+        if start_from is None:
+            self.current_pos = start_pos
+            if self.current_pos>self.duration:
+                self.current_pos = self.duration
 
-            if block.loop == self.LOOP_INFINITE:
-                if block_start_pos<start_pos:
-                    elapsed = start_pos-block_start_pos
-                    block_start_pos += (elapsed//block.duration)*block.duration
-                    block_start_pos = int(block_start_pos)
-            elif block_start_pos+block.duration<start_pos:
-                continue
+        audio_message.samples = out
+        return audio_message
+
+    def mix_blocks(self, start_pos, frame_count, out, audio_message, offline):
+        cached_count = self.render_cache.mix_into(self, start_pos, frame_count, out, offline)
+        if cached_count<frame_count:
+            self.render_blocks(
+                start_pos+cached_count, frame_count-cached_count,
+                out[cached_count:, :], audio_message, offline)
 
+    def render_blocks(self, start_pos, frame_count, out, audio_message, offline):
+        for i, block_start_pos, block in \
+                self.block_index.get_blocks_within(start_pos, start_pos+frame_count):
             if block_start_pos>start_pos:
-                block_samples = self.blank_data[:block_start_pos-start_pos, :]
+                out_offset = block_start_pos-start_pos
                 block_start_from = 0
                 sub_frame_count = start_pos + frame_count-block_start_pos
             else:
-                block_samples = None
+                out_offset = 0
                 block_start_from = start_pos-block_start_pos
                 sub_frame_count = frame_count
 
-            seg_message = block.get_samples(sub_frame_count, start_from=block_start_from)
+            seg_message = block.get_samples(
+                    sub_frame_count, start_from=block_start_from,
+                    out=out[out_offset:out_offset+sub_frame_count, :], offline=offline)
+            if seg_message is None:
+                continue
             if seg_message.midi_messages:
+                if out_offset:
+                    for midi_message in seg_message.midi_messages:
+                        midi_message.increase_delay(out_offset)
                 audio_message.midi_messages.extend(seg_message.midi_messages)
-            if seg_message.block_positions:
-                audio_message.block_positions.extend(seg_message.block_positions)
-
-            if block_samples is None:
-                block_samples = seg_message.samples
-            else:
-                block_samples = numpy.append(block_samples, seg_message.samples, axis=0)
-
-            if samples is None:
-                samples = block_samples
-            else:
-                samples  = samples + block_samples
-
-        if  samples is None:
-            samples = self.blank_data[:int(frame_count), :]
-
-        start_pos += frame_count
-
-        if start_from is None:
-            self.current_pos = start_pos
-            if self.current_pos>self.duration:
-                self.current_pos = self.duration
-
-        audio_message.block_positions.append([self, start_pos])
-        audio_message.samples = samples
-        return audio_message
 
     def get_instru_set(self):
         if self.linked_to:
@@ -330,19 +468,72 @@ class AudioTimedGroup(AudioBlock):
             instru_set = instru_set.union(block_instru_set)
         return instru_set
 
+    def load_samples(self):
+        for block in self.blocks:
+            block.load_samples()
+
+    def reset_after_fork(self, reset_blocks):
+        #linked copies share the lock, cache and children of the original
+        if self.linked_to:
+            self.linked_to.reset_after_fork(reset_blocks)
+            return
+        if self in reset_blocks:
+            return
+        reset_blocks.add(self)
+        self.lock = threading.RLock()
+        self.render_cache.lock = threading.Lock()
+        if self.linked_copies:
+            for linked_block in self.linked_copies:
+                linked_block.lock = self.lock
+        for block in self.blocks:
+            block.reset_after_fork(reset_blocks)
+
+    def are_samples_loaded(self, start_pos=0, end_pos=None):
+        if end_pos is None:
+            end_pos = self.block_index.get_end_pos()
+        for i, block_start_pos, block in \
+                self.block_index.get_blocks_within(start_pos, end_pos):
+            if not block.are_samples_loaded(
+                    max(start_pos-block_start_pos, 0), end_pos-block_start_pos):
+                return False
+        return True
+
+    def prefetch_samples(self, start_pos=0, end_pos=None):
+        if end_pos is None:
+            end_pos = self.block_index.get_end_pos()
+        for i, block_start_pos, block in \
+                self.block_index.get_blocks_within(start_pos, end_pos):
+            block.prefetch_samples(max(start_pos-block_start_pos, 0), end_pos-block_start_pos)
+
+    def prefetch_ahead(self, start_pos, loop, full_duration):
+        if loop == self.LOOP_INFINITE and full_duration>0:
+            start_pos %= full_duration
+        prefetch_count = int(self.PrefetchSeconds*AudioBlock.SampleRate)
+        prefetch_range = self.prefetch_range
+        #only asked again once the playhead is halfway through the last window
+        if prefetch_range and prefetch_range[0]<=start_pos and \
+                start_pos+prefetch_count//2<=prefetch_range[1]:
+            return
+        end_pos = start_pos+prefetch_count
+        self.prefetch_samples(start_pos, end_pos)
+        if loop and full_duration>0 and end_pos>full_duration:
+            self.prefetch_samples(0, end_pos-full_duration)
+        self.prefetch_range = (start_pos, end_pos)
+
     def save_to_file(self, filename):
-        wave_filename = filename + ".wav.temp" + str(time.time())
-        wave_file_writer = WaveFileWriter(wave_filename, sample_rate=AudioBlock.SampleRate)
-        buffer_size = AudioBlock.FramesPerBuffer
-        for i in xrange(0, self.duration_time.sample_count, buffer_size):
-            frame_count = min(self.duration_time.sample_count-i, buffer_size)
-            audio_message = self.get_samples(frame_count, start_from=i, use_loop=False, pausable=False)
-            wave_file_writer.write(audio_message.samples)
-        wave_file_writer.close()
-        audio_clip = moviepy.editor.AudioFileClip(wave_filename)
-        audio_clip.write_audiofile(filename, fps=int(AudioBlock.SampleRate))
-        del audio_clip
-        os.remove(wave_filename)
+        if os.path.splitext(filename)[1].lower() == ".wav":
+            file_writer = WaveFileWriter(filename, sample_rate=int(AudioBlock.SampleRate))
+        else:
+            file_writer = FFmpegAudioWriter(
+                filename, sample_rate=AudioBlock.SampleRate,
+                channel_count=AudioBlock.ChannelCount,
+                ffmpeg_binary=moviepy.config.get_setting("FFMPEG_BINARY"))
+        renderer = AudioOfflineRenderer(self, self.duration)
+        try:
+            for samples in renderer.get_segments():
+                file_writer.write(samples)
+        finally:
+            file_writer.close()
 
     def get_description(self):
         if self.linked_to:
@@ -39,6 +39,7 @@ class AudioBlockBox(object):
         self.y = 0.
         self.height = 50.
         self.image = None
+        self.image_version = None
 
         self.head_box = PointerBox(
                 self, align="left", y=0, abs_width=5, fill_color=self.HeadBoxColor)
@@ -286,13 +287,15 @@ class AudioBlockBox(object):
         draw_utils.draw_stroke(ctx, 2, self.BorderColor)
 
     def get_image(self):
-        if self.image:
+        if self.image and self.image_version == self.audio_block.content_version:
             return self.image
+        self.image = None
 
         if isinstance(self.audio_block, AudioSamplesBlock):
             bw = 200
             bh = 50
             self.image = cairo.ImageSurface(cairo.FORMAT_ARGB32, bw, bh)
+            self.image_version = self.audio_block.content_version
             ctx = cairo.Context(self.image)
             samples = self.audio_block.samples
             xunit = samples.shape[0]*1./bw
@@ -9,3 +9,4 @@ from music_note import MusicNote
 from interpolator import Interpolator
 from keyboard_state import KeyboardState
 from wave_file_writer import WaveFileWriter
+from ffmpeg_audio_writer import FFmpegAudioWriter
@@ -0,0 +1,34 @@
+import subprocess
+import numpy
+
+class FFmpegAudioWriter(object):
+    def __init__(self, filename, sample_rate, channel_count,
+                       ffmpeg_binary="ffmpeg", bitrate=None):
+        self.filename = filename
+        command = [
+            ffmpeg_binary, "-y", "-loglevel", "error",
+            "-f", "f32le", "-ar", "{0}".format(int(sample_rate)),
+            "-ac", "{0}".format(int(channel_count)), "-i", "-"]
+        if bitrate:
+            command.extend(["-b:a", bitrate])
+        command.append(filename)
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, data):
+        data = numpy.ascontiguousarray(data, dtype="<f4")
+        try:
+            self.process.stdin.write(data.tostring())
+        except IOError:
+            self.close()
+
+    def close(self):
+        if self.process is None:
+            return
+        process = self.process
+        self.process = None
+        stdout, stderr = process.communicate()
+        if process.returncode != 0:
+            raise IOError("ffmpeg failed to write {0}: {1}".format(
+                            self.filename, stderr.strip()))
@@ -2,25 +2,55 @@ from music_note import MusicNote
 import mido
 
 class MidiMessage(object):
-    def __init__(self, delay, mido_message):
+    NOTE_OFF = 0x80
+    NOTE_ON = 0x90
+    MAX_CHANNEL = 0x0F
+    MAX_DATA = 0x7F
+
+    def __init__(self, delay, midi_bytes):
         self.delay = delay
-        self.mido_message = mido_message
+        #kept as raw bytes, the mido message is only built at dispatch time
+        self.midi_bytes = midi_bytes
 
     def increase_delay(self, incre):
         self.delay += incre
 
+    @property
+    def mido_message(self):
+        return self.bytes_to_mido(self.midi_bytes)
+
+    @staticmethod
+    def bytes_to_mido(midi_bytes):
+        #None when the bytes do not make up one complete message,
+        #a data byte over 0x7F would be parsed as the status of another message
+        if not midi_bytes or any(byte>0x7F for byte in midi_bytes[1:]):
+            return None
+        try:
+            return mido.parse(midi_bytes)
+        except (ValueError, TypeError):
+            return None
+
     def __repr__(self):
         return "delay={0},mido={1}".format(self.delay, self.mido_message)
 
+    @classmethod
+    def check_values(cls, note, channel, velocity):
+        #masking would play a different channel, or turn a loud note into a note off
+        if note is None:
+            raise ValueError("unknown midi note")
+        if not 0<=channel<=cls.MAX_CHANNEL:
+            raise ValueError("midi channel {0} is out of range".format(channel))
+        if not 0<=velocity<=cls.MAX_DATA:
+            raise ValueError("midi velocity {0} is out of range".format(velocity))
+
     @classmethod
     def note_on(cls, delay, note, channel, velocity=64):
         note = MusicNote.get_note(note)
-        return cls(delay, mido.Message(
-            'note_on', note=note.midi_value, channel=channel, velocity=velocity))
+        cls.check_values(note, channel, velocity)
+        return cls(delay, (cls.NOTE_ON|channel, note.midi_value, velocity))
 
     @classmethod
     def note_off(cls, delay, note, channel):
         note = MusicNote.get_note(note)
-        return cls(delay, mido.Message(
-            'note_off', note=note.midi_value, channel=channel, velocity=0))
-
+        cls.check_values(note, channel, 0)
+        return cls(delay, (cls.NOTE_OFF|channel, note.midi_value, 0))
@@ -1,44 +1,204 @@
 import numpy
+import threading
+import fractions
+import scipy.signal
 
 #Adapted from http://zulko.github.io/blog/2014/03/29/soundstretching-and-pitch-shifting-in-python/
 
 class SamplesProcessor(object):
+    QUALITY_NEAREST = 0
+    QUALITY_LOW = 1
+    QUALITY_MEDIUM = 2
+    QUALITY_HIGH = 3
+
+    #quality -> (largest ratio denominator, filter half length per rate step, kaiser beta)
+    QUALITY_SETTINGS = {
+        QUALITY_LOW: (64, 4, 5.),
+        QUALITY_MEDIUM: (256, 10, 5.),
+        QUALITY_HIGH: (1024, 20, 8.6),
+    }
+
+    ResampleQuality = QUALITY_MEDIUM
+
+    #frames*channels*window values the phase vocoder transforms at once,
+    #small enough for the temporaries to stay in cache
+    StretchBatchValues = 2**16
+
+    PitchShiftMinWindow = 256
+    PitchShiftMaxWindow = 2048*24
+
+    #(up, down, quality) -> filter coefficients
+    Kernels = dict()
+    KernelLock = threading.Lock()
+
+    @staticmethod
+    def speed_up(samples, factor, quality=None):
+        if quality is None:
+            quality = SamplesProcessor.ResampleQuality
+        if quality == SamplesProcessor.QUALITY_NEAREST:
+            indices = numpy.round(numpy.arange(0, samples.shape[0], factor))
+            indices = indices[indices < samples.shape[0]].astype(int)
+            return samples[indices, :]
+        return SamplesProcessor.resample(samples, factor, quality)
+
+    @staticmethod
+    def get_resample_ratio(factor, quality):
+        max_term = SamplesProcessor.QUALITY_SETTINGS[quality][0]
+        #playing faster by factor means keeping one sample in every factor
+        if factor>=1:
+            ratio = fractions.Fraction(factor).limit_denominator(max_term)
+            return ratio.denominator, ratio.numerator
+        ratio = fractions.Fraction(1./factor).limit_denominator(max_term)
+        return ratio.numerator, ratio.denominator
+
+    @staticmethod
+    def get_resample_kernel(up, down, quality):
+        key = (up, down, quality)
+        SamplesProcessor.KernelLock.acquire()
+        kernel = SamplesProcessor.Kernels.get(key)
+        SamplesProcessor.KernelLock.release()
+        if kernel is None:
+            max_term, half_len_mult, beta = SamplesProcessor.QUALITY_SETTINGS[quality]
+            max_rate = max(up, down)
+            half_len = half_len_mult*max_rate
+            kernel = scipy.signal.firwin(
+                    2*half_len+1, 1./max_rate, window=("kaiser", beta))
+            SamplesProcessor.KernelLock.acquire()
+            SamplesProcessor.Kernels[key] = kernel
+            SamplesProcessor.KernelLock.release()
+        return kernel
+
     @staticmethod
-    def speed_up(samples, factor):
-        indices = numpy.round(numpy.arange(0, samples.shape[0], factor))
-        indices = indices[indices < samples.shape[0]].astype(int)
-        return samples[indices, :]
+    def resample(samples, factor, quality=None):
+        if quality is None:
+            quality = SamplesProcessor.ResampleQuality
+        up, down = SamplesProcessor.get_resample_ratio(factor, quality)
+        if up == down or samples.shape[0] == 0:
+            return samples.copy()
+        kernel = SamplesProcessor.get_resample_kernel(up, down, quality)
+        #all channels go through the polyphase filter in one call
+        resampled = scipy.signal.resample_poly(samples, up, down, axis=0, window=kernel)
+        return resampled.astype(samples.dtype)
 
     @staticmethod
     def stretch(samples, factor, window_size, hop_size):
-        phase  = numpy.zeros(window_size)
+        single_channel = samples.ndim == 1
+        if single_channel:
+            samples = samples.reshape(-1, 1)
+        sample_count, channel_count = samples.shape
+        window_size = int(window_size)
+        hop_size = max(int(hop_size), 1)
+        step = max(int(round(hop_size*factor)), 1)
+
+        #zero padding lets the first and last frames cover the ends of the samples,
+        #channels go first so every transform runs over contiguous memory
+        padded = numpy.zeros((channel_count, window_size+sample_count+window_size+hop_size))
+        padded[:, window_size: window_size+sample_count] = samples.T
+        frame_count = (padded.shape[1]-window_size-hop_size)//step+1
+        channel_stride, padded_stride = padded.strides
+        #(frame, channel, position in window) views, nothing is copied here
+        frames1 = numpy.lib.stride_tricks.as_strided(
+                    padded, shape=(frame_count, channel_count, window_size),
+                    strides=(step*padded_stride, channel_stride, padded_stride))
+        frames2 = numpy.lib.stride_tricks.as_strided(
+                    padded[:, hop_size:], shape=(frame_count, channel_count, window_size),
+                    strides=(step*padded_stride, channel_stride, padded_stride))
+
         hanning_window = numpy.hanning(window_size)
-        result = numpy.zeros(int(round(len(samples)/factor+window_size)), dtype=samples.dtype)
+        #frames this far apart in the output never overlap, so they add up as one slice
+        overlap_count = -(-window_size//hop_size)
+        span = overlap_count*hop_size
+        result = numpy.zeros((channel_count, (frame_count-1)*hop_size+span))
+        window_sum = numpy.zeros(result.shape[1])
+        span_window = numpy.zeros(span)
+        span_window[:window_size] = hanning_window**2
+
+        batch_size = max(1, SamplesProcessor.StretchBatchValues//(window_size*channel_count))
+        phasor = None
+        for batch_start in xrange(0, frame_count, batch_size):
+            batch_end = min(batch_start+batch_size, frame_count)
+            s1 = numpy.fft.rfft(frames1[batch_start: batch_end]*hanning_window)
+            s2 = numpy.fft.rfft(frames2[batch_start: batch_end]*hanning_window)
+            #phases are carried as unit phasors, which avoids angle() and exp()
+            s1_units, s1_magnitudes = SamplesProcessor.get_unit_phasors(s1)
+            s2_units, s2_magnitudes = SamplesProcessor.get_unit_phasors(s2)
+            steps = s2_units*numpy.conj(s1_units)
+            if phasor is None:
+                #the first frame keeps its own phase, the rest advance from it
+                steps[0] = s2_units[0]
+                phasor = numpy.ones(steps.shape[1:], dtype=steps.dtype)
+            phasors = numpy.cumprod(steps, axis=0)*phasor
+            phasor = SamplesProcessor.get_unit_phasors(phasors[-1])[0]
 
-        for i in numpy.arange(0, len(samples)-(window_size+hop_size), int(hop_size*factor)):
-            a1 = samples[i: i+window_size]
-            a2 = samples[i+hop_size: i+window_size+hop_size]
+            owners = SamplesProcessor.get_peak_owners(s2_magnitudes)
+            #bins around a spectral peak keep their phase relative to the peak,
+            #otherwise the lobe of a steady tone partly cancels itself
+            rotations = (phasors*numpy.conj(s2_units)).ravel().take(owners)
+            rephased = numpy.fft.irfft(s2*rotations, n=window_size)
+            rephased *= hanning_window
+            if span != window_size:
+                rephased = numpy.concatenate((rephased, numpy.zeros(
+                        rephased.shape[:2]+(span-window_size,))), axis=2)
 
-            s1 =  numpy.fft.fft(hanning_window * a1, )
-            s2 =  numpy.fft.fft(hanning_window * a2)
-            phase = (phase + numpy.angle(s2/s1)) % 2*numpy.pi
-            a2_rephased = numpy.fft.ifft(numpy.abs(s2)*numpy.exp(1j*phase))
+            for overlap_start in xrange(overlap_count):
+                first = batch_start+(overlap_start-batch_start)%overlap_count
+                if first>=batch_end:
+                    continue
+                class_frames = rephased[first-batch_start::overlap_count]
+                class_count = class_frames.shape[0]
+                start = first*hop_size
+                result[:, start: start+class_count*span] += \
+                        class_frames.transpose(1, 0, 2).reshape(channel_count, -1)
+                window_sum[start: start+class_count*span] += numpy.tile(span_window, class_count)
 
-            i2 = int(i/factor)
-            result[i2 : i2 + window_size] += hanning_window*a2_rephased.real
+        window_sum[window_sum<1e-3*window_sum.max()] = 1.
+        result /= window_sum
 
+        #frame k reads input from k*step+hop_size and is written at k*hop_size
+        scale = hop_size*1./step
+        start = int(round((window_size-hop_size)*scale))
+        result = result[:, start: start+int(round(sample_count*scale))].T
+        result = result.astype(samples.dtype)
+        if single_channel:
+            result = result[:, 0]
         return result
 
     @staticmethod
-    def pitch_shift(samples, factor, window_size=2048*24, hop_factor=1./8):
-        hop_size = int(window_size*hop_factor)
-        #window_size = 2**13
-        #hop_size = 2**11
-        return SamplesProcessor.speed_up(samples, factor)
-        stretched = numpy.zeros(0, dtype=samples.dtype)
-        for i in xrange(samples.shape[1]):
-            strt = SamplesProcessor.stretch(samples[:, i], 1.0/factor, window_size, hop_size)
-            stretched = numpy.append(stretched, strt)
-        stretched.shape = (-1, samples.shape[1])
-        return SamplesProcessor.speed_up(stretched[window_size:, :], factor)
+    def get_unit_phasors(values):
+        magnitudes = numpy.sqrt(values.real**2+values.imag**2)
+        scales = 1./numpy.maximum(magnitudes, 1e-300)
+        return values*scales, magnitudes
+
+    @staticmethod
+    def get_peak_owners(magnitudes):
+        #flat index of the nearest spectral peak in the same frame and channel, per bin
+        bin_count = magnitudes.shape[-1]
+        bin_ids = numpy.arange(bin_count)
+        peaks = numpy.zeros(magnitudes.shape, dtype=bool)
+        peaks[..., 1:-1] = (magnitudes[..., 1:-1]>magnitudes[..., :-2]) & \
+                           (magnitudes[..., 1:-1]>=magnitudes[..., 2:])
 
+        prev_peaks = numpy.maximum.accumulate(
+                        numpy.where(peaks, bin_ids, -bin_count), axis=-1)
+        next_peaks = numpy.where(peaks, bin_ids, 2*bin_count)[..., ::-1]
+        next_peaks = numpy.minimum.accumulate(next_peaks, axis=-1)[..., ::-1]
+        owners = numpy.where(next_peaks-bin_ids<bin_ids-prev_peaks, next_peaks, prev_peaks)
+        owners = numpy.where((owners<0)|(owners>=bin_count), bin_ids, owners)
+        row_starts = numpy.arange(0, magnitudes.size, bin_count).reshape(magnitudes.shape[:-1])
+        return owners+row_starts[..., None]
+
+    @staticmethod
+    def get_pitch_shift_window(sample_count):
+        #a window longer than a quarter of the samples leaves short notes almost silent
+        window_size = SamplesProcessor.PitchShiftMinWindow
+        while window_size*2<=sample_count//4:
+            window_size *= 2
+        return min(window_size, SamplesProcessor.PitchShiftMaxWindow)
+
+    @staticmethod
+    def pitch_shift(samples, factor, window_size=None, hop_factor=1./8):
+        if window_size is None:
+            window_size = SamplesProcessor.get_pitch_shift_window(samples.shape[0])
+        hop_size = int(window_size*hop_factor)
+        stretched = SamplesProcessor.stretch(samples, 1.0/factor, window_size, hop_size)
+        return SamplesProcessor.speed_up(stretched, factor)
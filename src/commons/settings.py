@@ -1,3 +1,6 @@
+import os
+
 APP_NAME = "blockaudio"
 APP_VERSION = "0.1"
 FILE_EXT = ".blau.xml"
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", APP_NAME)
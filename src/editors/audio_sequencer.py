@@ -12,6 +12,7 @@ from xml.etree.ElementTree import Element as XmlElement
 from xml.etree.ElementTree import dump as XmlDump
 from xml.etree.ElementTree import ElementTree as XmlTree
 import os
+import threading
 import xml.etree.ElementTree as ET
 from clipboard import Clipboard
 
@@ -369,6 +370,7 @@ class AudioSequencer(Gtk.Window):
         for block_elm in root_elm.findall(AudioBlock.TAG_NAME):
             block = self.load_block_from_xml(block_elm, root_elm, loaded_blocks, loaded_instrus)
             self.append_timed_group(block)
+            block.prefetch_samples()
 
     def load_block_by_name(self, block_name, root_elm, loaded_blocks, loaded_instrus):
         if block_name in loaded_blocks:
@@ -416,6 +418,16 @@ class AudioSequencer(Gtk.Window):
         self.instru_list.append(instru)
         self.instru_store.add(instru.get_name(), instru)
 
+    def scan_instru_library(self, path, test=True):
+        thread = threading.Thread(target=self.run_instru_library_scan, args=(path, test))
+        thread.daemon = True
+        thread.start()
+
+    def run_instru_library_scan(self, path, test):
+        #instruments show up in the list one by one while the scan goes on
+        for instru in AudioFileInstru.scan(path, test=test):
+            GObject.idle_add(self.append_instru, instru)
+
     def recompute_time(self):
         for block in self.timed_group_list:
             block.recompute_time(self.beat)
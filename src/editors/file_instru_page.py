@@ -47,6 +47,11 @@ class FileInstruPage(object):
         self.amplitude_spin_button.connect(
             "value-changed", self.amplitude_spin_button_value_changed)
 
+        self.keep_note_length_check_button = Gtk.CheckButton("Keep note length")
+        self.keep_note_length_check_button.set_active(self.instru.keep_note_length)
+        self.keep_note_length_check_button.connect(
+            "toggled", self.keep_note_length_check_button_toggled)
+
         #play/pause
         self.play_button = Gtk.Button("Play")
         self.play_button.connect("clicked", self.play_button_clicked)
@@ -66,6 +71,8 @@ class FileInstruPage(object):
         self.info_grid.attach(self.duration_heading_label, left=4, top=1, width=1, height=1)
         self.info_grid.attach(self.duration_value_entry, left=5, top=1, width=1, height=1)
         self.info_grid.attach(self.keypad_button, left=3, top=0, width=1, height=1)
+        self.info_grid.attach(
+            self.keep_note_length_check_button, left=0, top=2, width=2, height=1)
         self.info_grid.attach(Gtk.Label("Ampl."), left=4, top=0, width=1, height=1)
         self.info_grid.attach(self.amplitude_spin_button, left=5, top=0, width=1, height=1)
 
@@ -108,6 +115,10 @@ class FileInstruPage(object):
         if self.audio_server:
             self.audio_server.remove_block(self.audio_block)
 
+    def keep_note_length_check_button_toggled(self, widget):
+        self.instru.set_keep_note_length(widget.get_active())
+        self.block_viewer.redraw(full=True)
+
     def keypad_button_clicked(self, widget):
         self.piano_keypad = PianoKeypad(owner=self.owner)
         self.piano_keypad.set_instru(self.instru)
@@ -139,6 +150,7 @@ class FileInstruPage(object):
         if not self.audio_server:
             self.audio_server = AudioServer.get_default()
             self.audio_server.add_block(self.audio_block)
+            self.audio_server.subscribe_block(self.audio_block)
         self.audio_block.rewind()
         self.audio_server.play(self.audio_block)
         self.play_button.hide()
@@ -50,6 +50,11 @@ class FormulaInstruPage(object):
         self.keypad_button = Gtk.Button("Keypad")
         self.keypad_button.connect("clicked", self.keypad_button_clicked)
 
+        self.keep_note_length_check_button = Gtk.CheckButton("Keep note length")
+        self.keep_note_length_check_button.set_active(self.instru.keep_note_length)
+        self.keep_note_length_check_button.connect(
+            "toggled", self.keep_note_length_check_button_toggled)
+
         #play/pause
         self.play_button = Gtk.Button("Play")
         self.play_button.connect("clicked", self.play_button_clicked)
@@ -72,6 +77,8 @@ class FormulaInstruPage(object):
         self.info_grid.attach(self.duration_spin_button, left=1, top=1, width=1, height=1)
         self.info_grid.attach(self.duration_unit_combo_box, left=2, top=1, width=1, height=1)
         self.info_grid.attach(self.keypad_button, left=3, top=0, width=1, height=1)
+        self.info_grid.attach(
+            self.keep_note_length_check_button, left=0, top=3, width=2, height=1)
 
         self.play_button.props.valign = Gtk.Align.START
         self.pause_button.props.valign = Gtk.Align.START
@@ -164,6 +171,11 @@ class FormulaInstruPage(object):
         self.block_viewer.set_block(self.audio_block)
         if self.audio_server:
             self.audio_server.add_block(self.audio_block)
+            self.audio_server.subscribe_block(self.audio_block)
+
+    def keep_note_length_check_button_toggled(self, widget):
+        self.instru.set_keep_note_length(widget.get_active())
+        self.recreate_block_viewer()
 
     def keypad_button_clicked(self, widget):
         self.piano_keypad = PianoKeypad(owner=self.owner)
@@ -203,6 +215,7 @@ class FormulaInstruPage(object):
         if not self.audio_server:
             self.audio_server = AudioServer.get_default()
             self.audio_server.add_block(self.audio_block)
+            self.audio_server.subscribe_block(self.audio_block)
         self.audio_block.rewind()
         self.audio_server.play(self.audio_block)
         self.play_button.hide()
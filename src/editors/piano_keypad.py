@@ -1,5 +1,5 @@
 from gi.repository import Gtk, Gdk
-from ..commons import KeyboardState, MusicNote, Color, draw_utils
+from ..commons import KeyboardState, MusicNote, Color, draw_utils, MidiMessage
 from ..audio_blocks import AudioServer, AudioKeypadGroup, AudioTimedGroup
 from ..audio_blocks import AudioFormulaInstru, AudioFileInstru, AudioBlock
 from .. import formulators
@@ -120,7 +120,7 @@ class KeypadServerProcess(multiprocessing.Process):
         self.start()
 
     def run(self):
-        self.audio_server = AudioServer(buffer_mult=1)
+        self.audio_server = AudioServer(buffer_mult=1, low_latency=True)
         self.audio_server.play()
 
         self.audio_keypad_group = AudioKeypadGroup()
@@ -180,7 +180,7 @@ class PianoKeypad(Gtk.Window):
         self.mute_button = Gtk.CheckButton("Mute")
 
         self.midi_channel_spin_button = Gtk.SpinButton()
-        self.midi_channel_spin_button.set_range(-1, 128)
+        self.midi_channel_spin_button.set_range(-1, MidiMessage.MAX_CHANNEL)
         self.midi_channel_spin_button.set_value(-1)
         self.midi_channel_spin_button.set_increments(1, 1)
 
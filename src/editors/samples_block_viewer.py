@@ -82,7 +82,8 @@ class SamplesBlockViewer(Gtk.Box):
         self.graph_board.queue_draw()
 
     def generate_image_name(self):
-        return "{0}{1}{2}{3}{4}".format(
+        return "{0}:{1}{2}{3}{4}{5}".format(
+            self.audio_block.content_version,
             self.graph_board.get_allocated_width(),
             self.graph_board.get_allocated_height(),
             self.board_zoom,
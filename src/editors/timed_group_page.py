@@ -325,7 +325,7 @@ class TimedGroupPage(object):
         if not self.selected_child_block_box:
             return
         child_block = self.selected_child_block_box.audio_block
-        child_block.set_loop(widget.get_value())
+        self.audio_block.set_block_loop(child_block, widget.get_value())
 
     def name_save_button_clicked(self, widget):
         new_name = self.name_entry.get_text().strip()
@@ -359,7 +359,8 @@ class TimedGroupPage(object):
         if not self.selected_child_block_box:
             return
         child_block = self.selected_child_block_box.audio_block
-        child_block.set_duration_value(widget.get_value(), self.owner.beat)
+        self.audio_block.set_block_duration_value(
+            child_block, widget.get_value(), self.owner.beat)
         self.selected_child_block_box.update_size()
         self.block_box.update_size()
         self.redraw_timed_group_editor()
@@ -395,7 +396,8 @@ class TimedGroupPage(object):
         if self.selected_child_block_box:
             note_name = self.child_block_note_combo_box.get_value()
             if note_name:
-                self.selected_child_block_box.audio_block.set_note(note_name)
+                self.audio_block.set_block_note(
+                    self.selected_child_block_box.audio_block, note_name)
                 self.block_box.update_size()
                 self.timed_group_editor.queue_draw()
 
@@ -0,0 +1,55 @@
+import unittest
+import numpy
+from blockaudio.audio_blocks import AudioBlock, AudioSamplesBlock, AudioTimedGroup
+from blockaudio.audio_blocks.audio_block import AudioBlockTime
+from blockaudio.audio_blocks.audio_samples_instru import AudioSamplesInstru
+
+def new_samples_block(sample_count):
+    return AudioSamplesBlock(
+        numpy.ones((sample_count, AudioBlock.ChannelCount), dtype=numpy.float32))
+
+class ContentVersionTest(unittest.TestCase):
+    def test_block_changes_reach_every_owner(self):
+        top_group = AudioTimedGroup()
+        sub_group = AudioTimedGroup()
+        other_group = AudioTimedGroup()
+        block = new_samples_block(100)
+        sub_group.add_block(block, 0, AudioBlockTime.TIME_UNIT_SAMPLE, None)
+        top_group.add_block(sub_group, 0, AudioBlockTime.TIME_UNIT_SAMPLE, None)
+        top_group.add_block(other_group, 500, AudioBlockTime.TIME_UNIT_SAMPLE, None)
+
+        changes = (lambda: block.set_loop(AudioBlock.LOOP_INFINITE),
+                   lambda: block.set_midi_channel(3),
+                   lambda: block.set_duration(200, None),
+                   lambda: block.set_samples(block.samples*.5))
+        for change in changes:
+            versions = [top_group.content_version, sub_group.content_version,
+                        block.content_version, other_group.content_version]
+            change()
+            self.assertGreater(block.content_version, versions[2])
+            self.assertGreater(sub_group.content_version, versions[1])
+            self.assertGreater(top_group.content_version, versions[0])
+            self.assertEqual(other_group.content_version, versions[3])
+
+    def test_unchanged_block_keeps_its_version(self):
+        block = new_samples_block(100)
+        version = block.content_version
+        block.get_samples(50)
+        block.set_midi_channel(20)
+        self.assertEqual(block.content_version, version)
+
+    def test_instru_regenerates_notes_after_a_change(self):
+        instru = AudioSamplesInstru(
+            numpy.ones((1000, AudioBlock.ChannelCount), dtype=numpy.float32))
+        block = instru.create_note_block("G5")
+        self.assertIs(instru.get_samples_for("G5"), block.samples)
+
+        version = block.content_version
+        instru.samples = instru.samples*.5
+        instru.readjust_blocks()
+        self.assertGreater(block.content_version, version)
+        self.assertIs(instru.get_samples_for("G5"), block.samples)
+        self.assertAlmostEqual(block.samples[block.samples.shape[0]//2, 0], .5, delta=.01)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+import unittest
+import collections
+import tempfile
+import shutil
+import time
+import os
+import numpy
+import scipy.io.wavfile
+from blockaudio.audio_blocks import AudioBlock, AudioFileBlock
+from blockaudio.audio_blocks.audio_file_block import AudioFileBlockCache, AudioFileDiskCache
+
+def write_ramp_file(filename, frame_count):
+    ramp = (numpy.arange(frame_count)%1000).astype(numpy.int16).reshape(-1, 1)
+    samples = numpy.repeat(ramp, AudioBlock.ChannelCount, axis=1)
+    scipy.io.wavfile.write(filename, int(AudioBlock.SampleRate), samples)
+    return samples/32768.
+
+class CachedBlock(object):
+    #stands for a file block sharing the cached samples
+    def __init__(self):
+        self.unloaded = False
+
+    def unload_samples(self):
+        self.unloaded = True
+
+class AudioFileBlockCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.memory_limit = AudioFileBlockCache.MEMORY_LIMIT
+        self.entries = AudioFileBlockCache.Entries
+        self.total_memory = AudioFileBlockCache.TotalMemory
+        AudioFileBlockCache.Entries = collections.OrderedDict()
+        AudioFileBlockCache.TotalMemory = 0
+        AudioFileBlockCache.MEMORY_LIMIT = 3000
+
+    def tearDown(self):
+        AudioFileBlockCache.MEMORY_LIMIT = self.memory_limit
+        AudioFileBlockCache.Entries = self.entries
+        AudioFileBlockCache.TotalMemory = self.total_memory
+
+    def put(self, key):
+        block = CachedBlock()
+        #1000 bytes each
+        AudioFileBlockCache.put(key, numpy.zeros(250, dtype=numpy.float32), block)
+        return block
+
+    def test_least_recently_used_entry_is_evicted(self):
+        blocks = dict((key, self.put(key)) for key in ("a", "b", "c"))
+        self.assertEqual(AudioFileBlockCache.TotalMemory, 3000)
+        other_block = CachedBlock()
+        self.assertIsNot(AudioFileBlockCache.get("a", other_block), None)
+        AudioFileBlockCache.touch("b")
+
+        evictions = AudioFileBlockCache.get_stats()["evictions"]
+        blocks["d"] = self.put("d")
+        self.assertEqual(AudioFileBlockCache.Entries.keys(), ["a", "b", "d"])
+        self.assertEqual(AudioFileBlockCache.TotalMemory, 3000)
+        self.assertEqual(AudioFileBlockCache.get_stats()["evictions"], evictions+1)
+        self.assertTrue(blocks["c"].unloaded)
+        self.assertFalse(blocks["a"].unloaded)
+
+        #every block sharing an evicted entry gives up its samples
+        AudioFileBlockCache.set_memory_limit(1000)
+        self.assertEqual(AudioFileBlockCache.Entries.keys(), ["d"])
+        self.assertTrue(blocks["a"].unloaded)
+        self.assertTrue(other_block.unloaded)
+        self.assertFalse(blocks["d"].unloaded)
+
+    def test_released_block_is_not_unloaded(self):
+        block = self.put("a")
+        AudioFileBlockCache.release("a", block)
+        self.put("b")
+        AudioFileBlockCache.set_memory_limit(1000)
+        self.assertEqual(AudioFileBlockCache.Entries.keys(), ["b"])
+        self.assertFalse(block.unloaded)
+
+    def test_most_recent_entry_is_kept_over_budget(self):
+        AudioFileBlockCache.set_memory_limit(500)
+        self.put("a")
+        self.assertEqual(AudioFileBlockCache.Entries.keys(), ["a"])
+
+    def test_hits_and_misses_are_counted(self):
+        stats = AudioFileBlockCache.get_stats()
+        self.put("a")
+        self.assertEqual(AudioFileBlockCache.get("b", CachedBlock()), None)
+        AudioFileBlockCache.get("a", CachedBlock())
+        new_stats = AudioFileBlockCache.get_stats()
+        self.assertEqual(new_stats["hits"], stats["hits"]+1)
+        self.assertEqual(new_stats["misses"], stats["misses"]+1)
+        self.assertEqual(new_stats["entries"], 1)
+        self.assertEqual(new_stats["total_memory"], 1000)
+
+class AudioFileDiskCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = AudioFileDiskCache.CACHE_DIR
+        self.enabled = AudioFileDiskCache.Enabled
+        AudioFileDiskCache.CACHE_DIR = os.path.join(self.temp_dir, "cache")
+        AudioFileDiskCache.Enabled = True
+        self.filename = os.path.join(self.temp_dir, "song.mp3")
+        with open(self.filename, "wb") as f:
+            f.write("encoded")
+        self.samples = numpy.linspace(-1, 1, 2000).astype(numpy.float32).reshape(-1, 2)
+
+    def tearDown(self):
+        AudioFileDiskCache.CACHE_DIR = self.cache_dir
+        AudioFileDiskCache.Enabled = self.enabled
+        shutil.rmtree(self.temp_dir)
+
+    def test_saved_samples_are_mapped_back(self):
+        self.assertEqual(AudioFileDiskCache.load(self.filename, None), None)
+        saved = AudioFileDiskCache.save(self.filename, None, self.samples)
+        self.assertIsInstance(saved, numpy.memmap)
+        self.assertTrue(numpy.array_equal(saved, self.samples))
+        loaded = AudioFileDiskCache.load(self.filename, None)
+        self.assertTrue(numpy.array_equal(loaded, self.samples))
+        self.assertEqual(AudioFileDiskCache.load(self.filename, 500), None)
+        self.assertEqual(os.listdir(AudioFileDiskCache.CACHE_DIR),
+                         [os.path.basename(AudioFileDiskCache.get_path(self.filename, None))])
+
+    def test_changed_file_misses_the_cache(self):
+        AudioFileDiskCache.save(self.filename, None, self.samples)
+        with open(self.filename, "ab") as f:
+            f.write("more")
+        self.assertEqual(AudioFileDiskCache.load(self.filename, None), None)
+
+    def test_disabled_or_broken_cache_is_skipped(self):
+        AudioFileDiskCache.Enabled = False
+        self.assertEqual(AudioFileDiskCache.save(self.filename, None, self.samples), None)
+        AudioFileDiskCache.Enabled = True
+        with open(AudioFileDiskCache.CACHE_DIR, "w") as f:
+            f.write("not a directory")
+        self.assertEqual(AudioFileDiskCache.save(self.filename, None, self.samples), None)
+        self.assertEqual(AudioFileDiskCache.load(self.filename, None), None)
+        self.assertEqual(AudioFileDiskCache.get_path(self.filename+".missing", None), None)
+
+class AudioFileBlockLoadTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_dir, "ramp.wav")
+        self.expected = write_ramp_file(self.filename, 5000)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_realtime_read_plays_silence_until_loaded(self):
+        block = AudioFileBlock(self.filename)
+        samples = block.get_samples(1024, start_from=0).samples
+        self.assertEqual(samples.shape, (1024, AudioBlock.ChannelCount))
+        self.assertFalse(samples.any())
+
+        give_up_at = time.time()+2
+        while not block.are_samples_loaded() and time.time()<give_up_at:
+            time.sleep(.01)
+        self.assertTrue(block.are_samples_loaded())
+        samples = block.get_samples(1024, start_from=0).samples
+        self.assertTrue(numpy.allclose(samples, self.expected[:1024]))
+
+    def test_offline_read_loads_in_place(self):
+        block = AudioFileBlock(self.filename)
+        samples = block.get_samples(1024, start_from=1000, offline=True).samples
+        self.assertTrue(block.are_samples_loaded())
+        self.assertTrue(numpy.allclose(samples, self.expected[1000:2024]))
+
+    def test_prefetch_loads_in_the_background(self):
+        block = AudioFileBlock(self.filename)
+        block.prefetch_samples()
+        give_up_at = time.time()+2
+        while not block.are_samples_loaded() and time.time()<give_up_at:
+            time.sleep(.01)
+        self.assertTrue(numpy.allclose(block.samples, self.expected))
+
+if __name__ == "__main__":
+    unittest.main()
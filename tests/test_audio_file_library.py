@@ -0,0 +1,75 @@
+import unittest
+import tempfile
+import shutil
+import os
+import numpy
+import scipy.io.wavfile
+from blockaudio.audio_blocks.audio_file_library import AudioFileLibrary
+from blockaudio.audio_blocks.audio_file_reader import AudioFileInfo
+
+class AudioFileLibraryTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.library_dir = os.path.join(self.temp_dir, "library")
+        self.index_path = os.path.join(self.temp_dir, "cache", "index.json")
+        os.makedirs(os.path.join(self.library_dir, "drums", "kicks"))
+        os.makedirs(os.path.join(self.library_dir, "pads"))
+        for name in ("drums/snare.wav", "drums/kicks/deep.wav", "pads/warm.wav", "bell.wav"):
+            self.write_file(name)
+        with open(os.path.join(self.library_dir, "readme.txt"), "w") as f:
+            f.write("not audio")
+
+        self.probe = AudioFileInfo.probe
+        self.probes = []
+        def probe(cls, filename):
+            self.probes.append(os.path.basename(filename))
+            if not filename.endswith(".wav"):
+                return None
+            return self.probe(filename)
+        AudioFileInfo.probe = classmethod(probe)
+
+    def tearDown(self):
+        AudioFileInfo.probe = self.probe
+        shutil.rmtree(self.temp_dir)
+
+    def write_file(self, name):
+        scipy.io.wavfile.write(os.path.join(self.library_dir, name),
+                               44100, numpy.ones((4410, 2), dtype=numpy.int16))
+
+    def scan(self, **kwargs):
+        library = AudioFileLibrary(self.index_path)
+        return sorted(name for path, name in library.scan(self.library_dir, **kwargs))
+
+    def test_files_are_named_by_their_folders(self):
+        self.assertEqual(self.scan(), [
+            "bell", "drums/kicks/deep", "drums/snare", "pads/warm", "readme"])
+        self.assertEqual(self.scan(recursive=False, prefix="lib/"), ["lib/bell", "lib/readme"])
+        self.assertEqual(self.probes, [])
+
+    def test_tested_scan_skips_files_without_audio(self):
+        self.assertEqual(self.scan(test=True), [
+            "bell", "drums/kicks/deep", "drums/snare", "pads/warm"])
+        self.assertEqual(len(self.probes), 5)
+
+    def test_index_spares_unchanged_folders(self):
+        self.scan(test=True)
+        self.assertTrue(os.path.isfile(self.index_path))
+        del self.probes[:]
+        self.assertEqual(len(self.scan(test=True)), 4)
+        self.assertEqual(self.probes, [])
+
+        #a new file changes its folder only
+        self.write_file("pads/soft.wav")
+        self.assertEqual(self.scan(test=True), [
+            "bell", "drums/kicks/deep", "drums/snare", "pads/soft", "pads/warm"])
+        self.assertEqual(sorted(self.probes), ["soft.wav", "warm.wav"])
+
+    def test_stopped_scan_still_saves_the_index(self):
+        library = AudioFileLibrary(self.index_path)
+        scan = library.scan(self.library_dir, test=True)
+        scan.next()
+        scan.close()
+        self.assertTrue(os.path.isfile(self.index_path))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,268 @@
+import unittest
+import tempfile
+import shutil
+import struct
+import time
+import os
+import numpy
+import scipy.io.wavfile
+from blockaudio.audio_blocks import AudioBlock
+from blockaudio.audio_blocks import audio_file_reader
+from blockaudio.audio_blocks.audio_file_reader import AudioFileStreamReader, AudioFileMappedReader
+from blockaudio.audio_blocks.audio_file_reader import AudioFileHeader, AudioFileInfo
+from blockaudio.audio_blocks.audio_file_block import AudioFileClipSamples
+
+FrameCount = int(AudioBlock.SampleRate*20)
+
+def get_expected(start, end):
+    frames = numpy.arange(start, end).reshape(-1, 1)%1000/1000.
+    return numpy.repeat(frames, AudioBlock.ChannelCount, axis=1)
+
+class SlowAudioReader(object):
+    #stands for ffmpeg, every decode keeps the caller waiting
+    def __init__(self, filename, buffersize, fps, nbytes, nchannels):
+        self.duration = FrameCount/float(fps)
+        self.pos = 0
+        self.decode_delay = 0
+        self.buffer = self.read_chunk(buffersize)
+        self.decode_delay = .2
+
+    def seek(self, pos):
+        self.pos = pos
+
+    def read_chunk(self, frame_count):
+        time.sleep(self.decode_delay)
+        end = min(self.pos+frame_count, FrameCount)
+        samples = get_expected(self.pos, end)
+        self.pos = end
+        return samples
+
+class StreamReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.ffmpeg_reader = audio_file_reader.FFMPEG_AudioReader
+        audio_file_reader.FFMPEG_AudioReader = SlowAudioReader
+        self.stream_reader = AudioFileStreamReader("song.mp3")
+
+    def tearDown(self):
+        audio_file_reader.FFMPEG_AudioReader = self.ffmpeg_reader
+
+    def wait_read_ahead(self):
+        self.stream_reader.ahead_thread.join(5)
+
+    def test_offline_read_waits_for_decoding(self):
+        start = FrameCount//2
+        samples = self.stream_reader.read(start, start+1024, blocking=True)
+        self.assertTrue(numpy.allclose(samples, get_expected(start, start+1024)))
+
+    def test_realtime_seek_plays_silence_until_read_ahead(self):
+        start = FrameCount//2
+        read_at = time.time()
+        samples = self.stream_reader.read(start, start+1024, blocking=False)
+        self.assertLess(time.time()-read_at, .05)
+        self.assertEqual(samples.shape, (1024, AudioBlock.ChannelCount))
+        self.assertFalse(samples.any())
+
+        self.wait_read_ahead()
+        start += 1024
+        samples = self.stream_reader.read(start, start+1024, blocking=False)
+        self.assertTrue(numpy.allclose(samples, get_expected(start, start+1024)))
+
+    def test_sequential_realtime_reads_keep_up(self):
+        #decoding keeps ahead of playback as long as it is quicker than playing
+        window_frames = self.stream_reader.window_frames
+        for start in xrange(0, window_frames*3, 4096):
+            samples = self.stream_reader.read(start, start+4096, blocking=False)
+            self.assertTrue(numpy.allclose(samples, get_expected(start, start+4096)), start)
+            if self.stream_reader.ahead_thread is not None:
+                self.wait_read_ahead()
+
+    def test_read_past_the_end_is_padded(self):
+        samples = self.stream_reader.read(FrameCount-100, FrameCount+100)
+        self.assertEqual(samples.shape, (100, AudioBlock.ChannelCount))
+        self.assertTrue(numpy.allclose(samples, get_expected(FrameCount-100, FrameCount)))
+
+    def test_realtime_read_across_the_window_end(self):
+        window_frames = self.stream_reader.window_frames
+        start = window_frames-512
+        samples = self.stream_reader.read(start, start+1024, blocking=False)
+        #the read ahead is still decoding the frames after the window
+        self.assertTrue(numpy.allclose(samples[:512], get_expected(start, window_frames)))
+        self.assertFalse(samples[512:].any())
+
+        self.wait_read_ahead()
+        samples = self.stream_reader.read(start, start+1024, blocking=False)
+        self.assertTrue(numpy.allclose(samples, get_expected(start, start+1024)))
+
+class MappedReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_file(self, name, samples, sample_rate=int(AudioBlock.SampleRate)):
+        filename = os.path.join(self.temp_dir, name)
+        scipy.io.wavfile.write(filename, sample_rate, samples)
+        return filename
+
+    def test_pcm_file_is_read_in_place(self):
+        data = (numpy.arange(6000)-3000).astype(numpy.int16).reshape(-1, 2)
+        reader = AudioFileMappedReader.open(self.write_file("song.wav", data))
+        self.assertEqual(reader.frame_count, 3000)
+        self.assertIsInstance(reader.data, numpy.memmap)
+        samples = reader.read(1000, 1100)
+        self.assertEqual(samples.dtype, numpy.float32)
+        self.assertTrue(numpy.array_equal(samples, data[1000:1100]/32768.))
+        self.assertEqual(reader.read(2950, 3100).shape, (50, AudioBlock.ChannelCount))
+        self.assertEqual(reader.read(4000, 5000).shape, (0, AudioBlock.ChannelCount))
+        self.assertIs(reader.clone(), reader)
+
+    def test_mono_file_is_spread_over_channels(self):
+        data = numpy.arange(1000).astype(numpy.int16)
+        reader = AudioFileMappedReader.open(self.write_file("mono.wav", data))
+        samples = reader.read(10, 20)
+        self.assertEqual(samples.shape, (10, AudioBlock.ChannelCount))
+        self.assertTrue(numpy.array_equal(samples[:, 0], samples[:, -1]))
+        self.assertTrue(numpy.array_equal(samples[:, 0], data[10:20]/32768.))
+
+    def test_unsupported_files_are_left_to_ffmpeg(self):
+        data = numpy.zeros((100, 2), dtype=numpy.int16)
+        self.assertEqual(AudioFileMappedReader.open(
+            self.write_file("slow.wav", data, sample_rate=8000)), None)
+        self.assertEqual(AudioFileMappedReader.open(
+            self.write_file("song.mp3", data)), None)
+        self.assertEqual(AudioFileMappedReader.open(
+            os.path.join(self.temp_dir, "missing.wav")), None)
+
+    def test_clip_samples_slice_like_arrays(self):
+        data = (numpy.arange(6000)-3000).astype(numpy.int16).reshape(-1, 2)
+        clip_samples = AudioFileClipSamples(self.write_file("song.wav", data))
+        expected = data/32768.
+        self.assertEqual(clip_samples.shape, (3000, AudioBlock.ChannelCount))
+        self.assertTrue(numpy.allclose(clip_samples[100:200, :], expected[100:200]))
+        self.assertTrue(numpy.allclose(clip_samples[2900:, 1], expected[2900:, 1]))
+        self.assertTrue(numpy.allclose(clip_samples[5, :], expected[5]))
+        half_samples = clip_samples*.5
+        self.assertTrue(numpy.allclose(half_samples.read(100, 200), expected[100:200]*.5))
+        self.assertTrue(numpy.allclose(half_samples[100:200, :], expected[100:200]*.5))
+
+def get_chunk(chunk_id, data, byte_order="<"):
+    chunk = chunk_id+struct.pack(byte_order+"I", len(data))+data
+    if len(data)%2:
+        chunk += "\0"
+    return chunk
+
+def get_wave_data(format_tag, channel_count, bits, data, extensible=False):
+    block_align = channel_count*bits//8
+    fmt = struct.pack("<HHIIHH", 0xFFFE if extensible else format_tag, channel_count,
+                      44100, 44100*block_align, block_align, bits)
+    if extensible:
+        fmt += struct.pack("<HHIH", 22, bits, 0, format_tag)+"\0"*14
+    chunks = get_chunk("fmt ", fmt)+get_chunk("LIST", "odd")+get_chunk("data", data)
+    return "RIFF"+struct.pack("<I", len(chunks)+4)+"WAVE"+chunks
+
+def get_aiff_data(form_type, channel_count, bits, data, compression=None):
+    frame_count = len(data)//(channel_count*((bits+7)//8))
+    #44100 as an 80 bit extended float
+    comm = struct.pack(">hIhHQ", channel_count, frame_count, bits, 16398, 44100<<48)
+    if compression:
+        comm += compression+"\x04none"
+    chunks = get_chunk("COMM", comm, ">")+get_chunk("SSND", "\0"*8+data, ">")
+    return "FORM"+struct.pack(">I", len(chunks)+4)+form_type+chunks
+
+class AudioFileHeaderTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def read_samples(self, name, data):
+        filename = os.path.join(self.temp_dir, name)
+        with open(filename, "wb") as f:
+            f.write(data)
+        header = AudioFileHeader.read(filename)
+        if header is None:
+            return None
+        self.assertEqual(header.sample_rate, 44100)
+        return header.to_float(header.get_mapped_data())
+
+    def test_wave_formats(self):
+        values = numpy.array([[0, .5], [-.5, -1.]])
+        int16_data = (values*32768).astype("<i2").tostring()
+        uint8_data = (values*128+128).astype("u1").tostring()
+        int32_data = (values*2**31).astype("<i8").clip(-2**31, 2**31-1).astype("<i4")
+        int24_data = "".join(value.tostring()[1:] for value in int32_data.flatten())
+        float_data = values.astype("<f4").tostring()
+        for name, data in (
+                ("int16.wav", get_wave_data(1, 2, 16, int16_data)),
+                ("uint8.wav", get_wave_data(1, 2, 8, uint8_data)),
+                ("int24.wav", get_wave_data(1, 2, 24, int24_data)),
+                ("int32.wav", get_wave_data(1, 2, 32, int32_data.tostring())),
+                ("float.wav", get_wave_data(3, 2, 32, float_data)),
+                ("extensible.wav", get_wave_data(1, 2, 16, int16_data, extensible=True))):
+            samples = self.read_samples(name, data)
+            self.assertTrue(numpy.allclose(samples, values, atol=1e-4), name)
+
+    def test_aiff_formats(self):
+        values = numpy.array([[0, .5], [-.5, -1.]])
+        for name, data in (
+                ("big.aiff", get_aiff_data(
+                    "AIFF", 2, 16, (values*32768).astype(">i2").tostring())),
+                ("little.aifc", get_aiff_data(
+                    "AIFC", 2, 16, (values*32768).astype("<i2").tostring(), "sowt")),
+                ("float.aifc", get_aiff_data(
+                    "AIFC", 2, 32, values.astype(">f4").tostring(), "fl32"))):
+            samples = self.read_samples(name, data)
+            self.assertTrue(numpy.allclose(samples, values, atol=1e-4), name)
+
+    def test_bad_data_size_is_limited_by_the_file(self):
+        data = get_wave_data(1, 2, 16, "\0"*400)
+        data = data.replace("data"+struct.pack("<I", 400), "data"+struct.pack("<I", 10**6))
+        self.assertEqual(self.read_samples("streamed.wav", data).shape, (100, 2))
+
+    def test_unsupported_files_are_not_parsed(self):
+        self.assertEqual(self.read_samples("adpcm.wav", get_wave_data(2, 2, 4, "\0"*100)), None)
+        self.assertEqual(self.read_samples("ulaw.aifc", get_aiff_data(
+            "AIFC", 2, 16, "\0"*100, "ulaw")), None)
+        self.assertEqual(self.read_samples("short.wav", "RIFF\0\0"), None)
+        self.assertEqual(self.read_samples("song.mp3", get_wave_data(1, 2, 16, "\0"*4)), None)
+
+class AudioFileInfoTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.probe_ffmpeg = AudioFileInfo.probe_ffmpeg
+        self.ffmpeg_probes = []
+        def probe_ffmpeg(cls, filename):
+            self.ffmpeg_probes.append(filename)
+            return cls(filename, 12.5, 48000, AudioBlock.ChannelCount)
+        AudioFileInfo.probe_ffmpeg = classmethod(probe_ffmpeg)
+
+    def tearDown(self):
+        AudioFileInfo.probe_ffmpeg = self.probe_ffmpeg
+        shutil.rmtree(self.temp_dir)
+
+    def test_header_gives_the_duration(self):
+        filename = os.path.join(self.temp_dir, "song.wav")
+        scipy.io.wavfile.write(filename, 22050, numpy.zeros((11025, 2), dtype=numpy.int16))
+        info = AudioFileInfo.probe(filename)
+        self.assertEqual((info.duration, info.sample_rate, info.channel_count), (.5, 22050, 2))
+        self.assertEqual(self.ffmpeg_probes, [])
+
+    def test_file_is_probed_again_only_once_changed(self):
+        filename = os.path.join(self.temp_dir, "song.mp3")
+        with open(filename, "wb") as f:
+            f.write("encoded")
+        info = AudioFileInfo.probe(filename)
+        self.assertEqual(info.duration, 12.5)
+        self.assertIs(AudioFileInfo.probe(filename), info)
+        self.assertEqual(len(self.ffmpeg_probes), 1)
+
+        with open(filename, "ab") as f:
+            f.write("more")
+        self.assertIsNot(AudioFileInfo.probe(filename), info)
+        self.assertEqual(len(self.ffmpeg_probes), 2)
+        self.assertEqual(AudioFileInfo.probe(os.path.join(self.temp_dir, "missing.mp3")), None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import threading
+import numpy
+from blockaudio.audio_blocks import AudioBlock, AudioSamplesBlock
+from blockaudio.audio_blocks.audio_group import AudioGroup
+
+def new_samples_block(sample_count, value=1.):
+    samples = numpy.ones((sample_count, AudioBlock.ChannelCount), dtype=numpy.float32)
+    return AudioSamplesBlock(samples*value)
+
+def render_while_locked(group, render):
+    #stands for an editor that holds the group lock while the render thread runs
+    held = threading.Event()
+    release = threading.Event()
+    def hold_lock():
+        group.lock.acquire()
+        held.set()
+        release.wait()
+        group.lock.release()
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    held.wait()
+
+    results = []
+    render_thread = threading.Thread(target=lambda: results.append(render()))
+    render_thread.daemon = True
+    try:
+        render_thread.start()
+        render_thread.join(2)
+    finally:
+        release.set()
+        holder.join()
+    return results
+
+class AudioGroupTest(unittest.TestCase):
+    def test_children_are_mixed_into_one_buffer(self):
+        group = AudioGroup()
+        group.add_block(new_samples_block(4000, .25))
+        group.add_block(new_samples_block(4000, .5))
+        first = group.get_samples(1024).samples
+        self.assertEqual(first.shape, (1024, AudioBlock.ChannelCount))
+        self.assertTrue((first == .75).all())
+
+        #the returned samples outlive the next call, which reuses the mix buffer
+        second = group.get_samples(1024).samples
+        self.assertFalse(numpy.may_share_memory(first, second))
+        self.assertTrue((first == .75).all())
+
+        out = AudioBlock.get_blank_data(1024)
+        out.fill(1.)
+        message = group.get_samples(1024, out=out)
+        self.assertIs(message.samples, out)
+        self.assertTrue((out == 1.75).all())
+
+    def test_render_reads_the_published_blocks_without_locking(self):
+        group = AudioGroup()
+        first_block = new_samples_block(4000, .25)
+        group.add_block(first_block)
+        self.assertEqual(group.blocks_snapshot, (first_block,))
+        snapshot = group.blocks_snapshot
+        group.add_block(new_samples_block(4000, .5))
+        self.assertEqual(snapshot, (first_block,))
+        self.assertEqual(len(group.blocks_snapshot), 2)
+
+        results = render_while_locked(group, lambda: group.get_samples(1024).samples)
+        self.assertEqual(len(results), 1)
+        self.assertTrue((results[0] == .75).all())
+
+        group.remove_block(first_block)
+        self.assertEqual(len(group.blocks_snapshot), 1)
+        self.assertTrue((group.get_samples(1024).samples == .5).all())
+
+    def test_empty_group_returns_no_samples(self):
+        group = AudioGroup()
+        self.assertEqual(group.get_samples(1024).samples, None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import numpy
+from blockaudio.audio_blocks import AudioBlock
+from blockaudio.audio_blocks.audio_samples_instru import AudioSamplesInstru
+from blockaudio.commons import MusicNote
+
+def new_tone(frequency, frame_count):
+    tone = numpy.sin(numpy.arange(frame_count)*2*numpy.pi*frequency/AudioBlock.SampleRate)
+    tone = tone.astype(numpy.float32).reshape(-1, 1)
+    return numpy.repeat(tone, AudioBlock.ChannelCount, axis=1)
+
+def get_peak_frequency(samples):
+    spectrum = numpy.abs(numpy.fft.rfft(samples[:, 0]*numpy.hanning(samples.shape[0])))
+    return numpy.argmax(spectrum)*AudioBlock.SampleRate/samples.shape[0]
+
+class SamplesInstruTest(unittest.TestCase):
+    def setUp(self):
+        self.base_note = MusicNote.get_note("C5")
+        self.note = MusicNote.get_note("G5")
+        self.factor = self.note.frequency/self.base_note.frequency
+
+    def check_note_block(self, frame_count):
+        instru = AudioSamplesInstru(new_tone(self.base_note.frequency, frame_count))
+        block = instru.create_note_block(self.note.name)
+
+        #speeding up raises the pitch and shortens the note alike
+        self.assertAlmostEqual(
+            block.samples.shape[0], frame_count/self.factor, delta=frame_count*.01)
+        self.assertAlmostEqual(
+            get_peak_frequency(block.samples), self.note.frequency, delta=self.note.frequency*.02)
+
+        instru.set_keep_note_length(True)
+        instru.refill_block(block)
+        self.assertAlmostEqual(block.samples.shape[0], frame_count, delta=frame_count*.01)
+        self.assertAlmostEqual(
+            get_peak_frequency(block.samples), self.note.frequency, delta=self.note.frequency*.02)
+        middle = block.samples[frame_count//4:-frame_count//4, 0]
+        self.assertAlmostEqual(numpy.sqrt((middle**2).mean()), numpy.sqrt(.5), delta=.05)
+
+    def test_long_note_keeps_length_and_moves_pitch(self):
+        self.check_note_block(int(AudioBlock.SampleRate))
+
+    def test_short_note_keeps_length_and_moves_pitch(self):
+        self.check_note_block(4000)
+
+    def test_keep_note_length_is_saved(self):
+        instru = AudioSamplesInstru(new_tone(self.base_note.frequency, 1000))
+        instru.set_keep_note_length(True)
+        loaded_instru = AudioSamplesInstru(new_tone(self.base_note.frequency, 1000))
+        loaded_instru.load_from_xml(instru.get_xml_element())
+        self.assertTrue(loaded_instru.keep_note_length)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import threading
+import tempfile
+import shutil
+import os
+import numpy
+import scipy.io.wavfile
+from blockaudio.audio_blocks import AudioBlock, AudioSamplesBlock, AudioTimedGroup
+from blockaudio.audio_blocks import AudioFileBlock, AudioOfflineRenderer
+from blockaudio.audio_blocks.audio_block import AudioBlockTime
+from blockaudio.audio_blocks.audio_file_block import AudioFileBlockCache, AudioFileDiskCache
+
+def render_all(block, frame_count, processes):
+    renderer = AudioOfflineRenderer(block, frame_count, processes=processes)
+    renderer.SegmentFrames = 4096
+    return numpy.concatenate(list(renderer.get_segments()), axis=0)
+
+class OfflineRendererTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.disk_cache_enabled = AudioFileDiskCache.Enabled
+        AudioFileDiskCache.Enabled = False
+
+    def tearDown(self):
+        AudioFileDiskCache.Enabled = self.disk_cache_enabled
+        shutil.rmtree(self.temp_dir)
+
+    def new_group(self):
+        frame_count = int(AudioBlock.SampleRate)
+        wave = numpy.sin(numpy.arange(frame_count)*2*numpy.pi*440/AudioBlock.SampleRate)
+        wave = numpy.repeat(wave.reshape(-1, 1), AudioBlock.ChannelCount, axis=1)
+        filename = os.path.join(self.temp_dir, "tone.wav")
+        scipy.io.wavfile.write(
+            filename, int(AudioBlock.SampleRate), (wave*20000).astype(numpy.int16))
+
+        group = AudioTimedGroup()
+        group.add_block(AudioFileBlock(filename), 1000, AudioBlockTime.TIME_UNIT_SAMPLE, None)
+        ramp = numpy.linspace(0, 1, 30000).astype(numpy.float32)
+        ramp = numpy.repeat(ramp.reshape(-1, 1), AudioBlock.ChannelCount, axis=1)
+        sub_group = AudioTimedGroup()
+        sub_group.add_block(AudioSamplesBlock(ramp), 0, AudioBlockTime.TIME_UNIT_SAMPLE, None)
+        group.add_block(sub_group, 5000, AudioBlockTime.TIME_UNIT_SAMPLE, None)
+        group.add_block(sub_group.copy(linked=True), 40000,
+                        AudioBlockTime.TIME_UNIT_SAMPLE, None)
+        return group, sub_group
+
+    def test_parallel_export_matches_serial(self):
+        group, sub_group = self.new_group()
+        frame_count = group.duration+3000
+        serial = render_all(group, frame_count, 1)
+        self.assertEqual(serial.shape, (frame_count, AudioBlock.ChannelCount))
+        self.assertTrue(numpy.abs(serial).max()>0.5)
+        parallel = render_all(group, frame_count, 3)
+        self.assertTrue(numpy.array_equal(serial, parallel))
+
+    def test_workers_renew_locks_held_at_fork(self):
+        group, sub_group = self.new_group()
+        frame_count = group.duration
+        serial = render_all(group, frame_count, 1)
+
+        #stands for a render thread that is inside the cache when the pool forks
+        release = threading.Event()
+        def hold_locks():
+            group.render_cache.lock.acquire()
+            AudioFileBlockCache.Lock.acquire()
+            held.set()
+            release.wait()
+            AudioFileBlockCache.Lock.release()
+            group.render_cache.lock.release()
+        held = threading.Event()
+        holder = threading.Thread(target=hold_locks)
+        holder.start()
+        held.wait()
+
+        results = []
+        def render_parallel():
+            results.append(render_all(group, frame_count, 2))
+        renderer_thread = threading.Thread(target=render_parallel)
+        renderer_thread.daemon = True
+        try:
+            renderer_thread.start()
+            renderer_thread.join(30)
+        finally:
+            release.set()
+            holder.join()
+        self.assertFalse(renderer_thread.is_alive())
+        self.assertTrue(numpy.array_equal(serial, results[0]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import numpy
+from blockaudio.audio_blocks import AudioBlock, AudioSamplesBlock
+
+def new_ramp_block(sample_count):
+    ramp = numpy.arange(1, sample_count+1, dtype=numpy.float32).reshape(-1, 1)
+    return AudioSamplesBlock(numpy.repeat(ramp, AudioBlock.ChannelCount, axis=1))
+
+class SamplesBlockReadTest(unittest.TestCase):
+    def test_one_stretch_is_read_without_copying(self):
+        block = new_ramp_block(5000)
+        block.set_loop(AudioBlock.LOOP_NONE)
+        samples = block.get_samples(1024, start_from=100).samples
+        self.assertTrue(numpy.may_share_memory(samples, block.samples))
+        self.assertTrue(numpy.array_equal(samples, block.samples[100:1124]))
+
+    def test_reads_are_added_into_the_given_buffer(self):
+        block = new_ramp_block(5000)
+        block.set_loop(AudioBlock.LOOP_NONE)
+        out = AudioBlock.get_blank_data(1024)
+        out.fill(1.)
+        message = block.get_samples(1024, start_from=100, out=out)
+        self.assertIs(message.samples, out)
+        self.assertTrue(numpy.array_equal(out, block.samples[100:1124]+1.))
+
+    def test_read_past_the_end_is_padded(self):
+        block = new_ramp_block(5000)
+        block.set_loop(AudioBlock.LOOP_NONE)
+        samples = block.get_samples(1024, start_from=4500).samples
+        self.assertEqual(samples.shape, (1024, AudioBlock.ChannelCount))
+        self.assertTrue(numpy.array_equal(samples[:500], block.samples[4500:]))
+        self.assertFalse(samples[500:].any())
+        self.assertFalse(numpy.may_share_memory(samples, block.samples))
+
+    def test_play_position_advances(self):
+        block = new_ramp_block(5000)
+        block.set_loop(AudioBlock.LOOP_NONE)
+        first = block.get_samples(1024).samples.copy()
+        second = block.get_samples(1024).samples
+        self.assertEqual(block.current_pos, 2048)
+        self.assertTrue(numpy.array_equal(
+            numpy.concatenate((first, second)), block.samples[:2048]))
+
+class SamplesBlockLoopTest(unittest.TestCase):
+    def get_expected(self, block, start_pos, frame_count):
+        sample_count = block.samples.shape[0]
+        expected = AudioBlock.get_blank_data(frame_count)
+        for i in xrange(frame_count):
+            pos = start_pos+i
+            if block.loop == AudioBlock.LOOP_STRETCH:
+                if pos<block.duration:
+                    expected[i] = block.samples[pos%sample_count]
+            elif pos%block.duration<sample_count:
+                expected[i] = block.samples[pos%block.duration]
+        return expected
+
+    def assert_loop_reads(self, block):
+        for start_pos in (0, 7, 95, 1000, 4321):
+            for frame_count in (1, 64, 1024, 5000):
+                samples = block.get_samples(frame_count, start_from=start_pos).samples
+                self.assertTrue(numpy.array_equal(
+                    samples, self.get_expected(block, start_pos, frame_count)),
+                    (block.loop, start_pos, frame_count))
+
+    def test_infinite_loop_repeats_samples(self):
+        block = new_ramp_block(100)
+        block.set_loop(AudioBlock.LOOP_INFINITE)
+        self.assert_loop_reads(block)
+        #a period longer than the samples is padded with silence
+        block.set_duration(130, None)
+        self.assert_loop_reads(block)
+
+    def test_stretch_loop_repeats_samples_until_the_duration(self):
+        block = new_ramp_block(100)
+        block.set_loop(AudioBlock.LOOP_STRETCH)
+        block.set_duration(4500, None)
+        self.assert_loop_reads(block)
+
+    def test_play_position_wraps(self):
+        block = new_ramp_block(100)
+        block.set_loop(AudioBlock.LOOP_INFINITE)
+        block.get_samples(1050)
+        self.assertEqual(block.current_pos, 50)
+        samples = block.get_samples(100).samples
+        self.assertTrue(numpy.array_equal(samples, self.get_expected(block, 50, 100)))
+
+    def test_each_wrap_sends_midi_notes(self):
+        block = new_ramp_block(100)
+        block.set_loop(AudioBlock.LOOP_INFINITE)
+        block.set_midi_channel(0)
+        messages = block.get_samples(1000, start_from=50).midi_messages
+        note_ons = [message.delay for message in messages if message.midi_bytes[0] == 0x90]
+        note_offs = [message.delay for message in messages if message.midi_bytes[0] == 0x80]
+        self.assertEqual(note_ons, range(50, 1000, 100))
+        self.assertEqual(note_offs, range(50, 1001, 100))
+
+if __name__ == "__main__":
+    unittest.main()
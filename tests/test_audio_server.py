@@ -0,0 +1,299 @@
+import unittest
+import threading
+import time
+import mido
+import numpy
+from blockaudio.audio_blocks import AudioBlock, AudioSamplesBlock
+from blockaudio.audio_blocks import audio_server
+from blockaudio.audio_blocks.audio_server import MidiThread, AudioServer, AudioRingBuffer
+from blockaudio.audio_blocks.audio_server import AudioServerStats
+
+class MidiOutput(object):
+    def __init__(self):
+        self.sent = []
+        self.sent_event = threading.Event()
+
+    def send(self, message):
+        self.sent.append((time.time(), message))
+        self.sent_event.set()
+
+class MidiThreadTest(unittest.TestCase):
+    def setUp(self):
+        self.midi_output = MidiOutput()
+        self.open_output = mido.open_output
+        mido.open_output = lambda *args, **kwargs: self.midi_output
+        self.midi_thread = MidiThread()
+
+    def tearDown(self):
+        self.midi_thread.close()
+        mido.open_output = self.open_output
+
+    def wait_sent(self, count, timeout=1.):
+        give_up_at = time.time()+timeout
+        while len(self.midi_output.sent)<count and time.time()<give_up_at:
+            self.midi_output.sent_event.wait(.01)
+            self.midi_output.sent_event.clear()
+
+    def test_events_are_sent_in_time_order(self):
+        now = time.time()
+        self.midi_thread.schedule([
+            (now+.04, (0x90, 60, 64)), (now+.02, (0x91, 61, 64)), (now+.02, (0x80, 60, 0))])
+        self.wait_sent(3)
+        messages = [message for sent_at, message in self.midi_output.sent]
+        self.assertEqual([(message.type, message.channel) for message in messages],
+                         [("note_on", 1), ("note_off", 0), ("note_on", 0)])
+
+    def test_earlier_event_wakes_a_waiting_thread(self):
+        now = time.time()
+        self.midi_thread.schedule([(now+10., (0x80, 60, 0))])
+        for i in xrange(5):
+            #the thread is sleeping until the distant note off meanwhile
+            time.sleep(.1)
+            scheduled_at = time.time()
+            self.midi_thread.schedule([(scheduled_at, (0x90, 60, 64))])
+            self.wait_sent(i+1)
+            self.assertEqual(len(self.midi_output.sent), i+1)
+            self.assertLess(self.midi_output.sent[i][0]-scheduled_at, .005)
+
+    def test_clock_change_keeps_pending_events(self):
+        now = time.time()
+        self.midi_thread.schedule([(now+.2, (0x90, 60, 64))])
+        #every event would be overdue on a clock this far ahead
+        self.midi_thread.set_clock(lambda: time.time()+1000.)
+        time.sleep(.1)
+        self.assertEqual(self.midi_output.sent, [])
+        self.wait_sent(1)
+        self.assertEqual(len(self.midi_output.sent), 1)
+        self.assertGreater(self.midi_output.sent[0][0]-now, .15)
+
+class OutputStream(object):
+    #calls back from its own thread at the pace of the buffers, as portaudio does
+    def __init__(self, frames_per_buffer, stream_callback, **kwargs):
+        self.frames_per_buffer = frames_per_buffer
+        self.stream_callback = stream_callback
+        self.outputs = []
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        period = self.frames_per_buffer/AudioBlock.SampleRate
+        while self.running:
+            data, flag = self.stream_callback(
+                None, self.frames_per_buffer, {"output_buffer_dac_time": self.get_time()}, 0)
+            self.outputs.append(numpy.fromstring(data, dtype=numpy.float32))
+            time.sleep(period)
+
+    def get_time(self):
+        return time.time()
+
+    def stop_stream(self):
+        self.running = False
+        self.thread.join()
+
+    def close(self):
+        pass
+
+class PortAudio(object):
+    def __init__(self):
+        self.streams = []
+
+    def get_host_api_count(self):
+        return 0
+
+    def open(self, **kwargs):
+        stream = OutputStream(**kwargs)
+        self.streams.append(stream)
+        return stream
+
+    def terminate(self):
+        pass
+
+class SlowBlock(AudioBlock):
+    #too slow for the low latency buffers only
+    def __init__(self):
+        super(SlowBlock, self).__init__()
+        self.lock = threading.Lock()
+        self.rendering_count = 0
+        self.max_rendering_count = 0
+        self.frame_counts = []
+
+    def get_samples(self, frame_count, start_from=None, use_loop=True, loop=None,
+                          out=None, offline=False):
+        self.lock.acquire()
+        self.rendering_count += 1
+        self.max_rendering_count = max(self.max_rendering_count, self.rendering_count)
+        self.frame_counts.append(frame_count)
+        self.lock.release()
+        if frame_count<AudioBlock.FramesPerBuffer:
+            time.sleep(frame_count/AudioBlock.SampleRate)
+        self.lock.acquire()
+        self.rendering_count -= 1
+        self.lock.release()
+        return super(SlowBlock, self).get_samples(frame_count, out=out)
+
+class AudioRingBufferTest(unittest.TestCase):
+    def test_slots_are_read_in_write_order(self):
+        ring_buffer = AudioRingBuffer(4, 3)
+        self.assertEqual(ring_buffer.read(), None)
+        for i in xrange(3):
+            ring_buffer.get_write_slot().fill(i+1)
+            ring_buffer.commit_write(("message", i))
+        self.assertTrue(ring_buffer.is_full())
+        self.assertEqual(ring_buffer.get_fill_count(), 3)
+
+        for i in xrange(3):
+            slot, message = ring_buffer.read()
+            self.assertTrue((slot == i+1).all())
+            self.assertEqual(message, ("message", i))
+            ring_buffer.commit_read()
+            #a freed slot is handed out blank for the next write
+            self.assertFalse(ring_buffer.get_write_slot().any())
+            ring_buffer.commit_write(("message", i+3))
+        self.assertEqual(ring_buffer.get_fill_count(), 3)
+        self.assertEqual(ring_buffer.read()[1], ("message", 3))
+
+class AudioServerStatsTest(unittest.TestCase):
+    def test_callbacks_and_renders_are_counted(self):
+        stats = AudioServerStats()
+        stats.add_callback(0, 2)
+        stats.add_callback(audio_server.pyaudio.paOutputUnderflow, 0)
+        stats.add_callback(audio_server.pyaudio.paOutputUnderflow, None)
+        stats.add_underrun()
+        buffer_time = 1024/AudioBlock.SampleRate
+        for load in (.1, .1, .6, 1.2, 3.):
+            stats.add_render_time(buffer_time*load, 1024)
+
+        result = stats.get_stats()
+        self.assertEqual(result["callbacks"], 3)
+        self.assertEqual(result["underruns"], 1)
+        self.assertEqual(result["status_flags"]["output_underflow"], 2)
+        self.assertEqual(result["status_flags"]["output_overflow"], 0)
+        self.assertEqual(result["queue_depths"], {2: 1, 0: 1})
+        self.assertEqual(result["renders"], 5)
+        self.assertEqual(result["deadline_misses"], 2)
+        self.assertAlmostEqual(result["max_render_load"], 3.)
+        self.assertEqual([count for edge, count in result["render_load_histogram"]],
+                         [2, 0, 1, 0, 1, 0, 1])
+        self.assertIn("underruns=1", stats.get_summary_text())
+
+        stats.reset()
+        self.assertEqual(stats.get_stats()["callbacks"], 0)
+        self.assertEqual(stats.get_stats()["max_render_load"], 0.)
+
+class StuckBlock(AudioBlock):
+    #keeps the render thread busy until released
+    def __init__(self):
+        super(StuckBlock, self).__init__()
+        self.release = threading.Event()
+
+    def get_samples(self, frame_count, start_from=None, use_loop=True, loop=None,
+                          out=None, offline=False):
+        self.release.wait(2)
+        return super(StuckBlock, self).get_samples(frame_count, out=out)
+
+class AudioServerTest(unittest.TestCase):
+    def setUp(self):
+        self.open_output = mido.open_output
+        mido.open_output = lambda *args, **kwargs: MidiOutput()
+        self.port_audio = audio_server.pyaudio.PyAudio
+        audio_server.pyaudio.PyAudio = PortAudio
+
+    def tearDown(self):
+        AudioServer.close_all()
+        audio_server.pyaudio.PyAudio = self.port_audio
+        mido.open_output = self.open_output
+
+    def test_queued_buffers_play_in_order(self):
+        server = AudioServer()
+        frame_count = AudioBlock.FramesPerBuffer*20
+        ramp = numpy.arange(1, frame_count+1, dtype=numpy.float32)
+        block = AudioSamplesBlock(
+            numpy.repeat(ramp.reshape(-1, 1), AudioBlock.ChannelCount, axis=1))
+        block.set_loop(AudioBlock.LOOP_NONE)
+        server.add_block(block)
+        server.play()
+
+        streams = server.pa_manager.streams
+        give_up_at = time.time()+3
+        while (not streams or len(streams[0].outputs)<12) and time.time()<give_up_at:
+            time.sleep(.01)
+        outputs = [output[::AudioBlock.ChannelCount] for output in streams[0].outputs[:12]]
+        #buffers before the first render play silence
+        while outputs and not outputs[0].any():
+            del outputs[0]
+        played = numpy.concatenate(outputs)
+        self.assertGreater(played.shape[0], 0)
+        self.assertTrue(numpy.array_equal(played, ramp[:played.shape[0]]))
+
+    def test_late_render_is_counted_as_underrun(self):
+        server = AudioServer()
+        block = StuckBlock()
+        server.add_block(block)
+        server.play()
+        try:
+            give_up_at = time.time()+2
+            while server.get_stats()["underruns"] == 0 and time.time()<give_up_at:
+                time.sleep(.01)
+        finally:
+            block.release.set()
+        stats = server.get_stats()
+        self.assertGreater(stats["underruns"], 0)
+        self.assertGreaterEqual(stats["callbacks"], stats["underruns"])
+        self.assertEqual(stats["low_latency"], False)
+        self.assertEqual(stats["frames_per_buffer"], AudioBlock.FramesPerBuffer)
+
+    def wait_stream(self, server):
+        give_up_at = time.time()+2
+        while server.stream is None and time.time()<give_up_at:
+            time.sleep(.01)
+
+    def test_playheads_are_published_with_each_buffer(self):
+        server = AudioServer()
+        server.paused = True
+        self.wait_stream(server)
+        block = AudioBlock()
+        other_block = AudioBlock()
+        self.assertEqual(server.get_playheads(), None)
+        server.subscribe_block(block)
+        server.subscribe_block(other_block)
+        server.subscribe_block(block)
+        block.set_current_pos(20000)
+        self.assertEqual(server.get_playheads(), ((block, 20000), (other_block, 0)))
+        server.unsubscribe_block(other_block)
+
+        dac_time = time.time()+.1
+        server.dispatch_message(None, server.get_playheads(), 1024,
+                                {"output_buffer_dac_time": dac_time})
+        ends_at, playheads = server.playhead_table
+        self.assertAlmostEqual(ends_at, dac_time+1024/AudioBlock.SampleRate)
+        self.assertEqual(playheads, ((block, 20000),))
+
+        #the published position is only reached once the buffer has played
+        server.update_play_positions()
+        lag = (ends_at-time.time())*AudioBlock.SampleRate
+        self.assertAlmostEqual(block.play_pos, 20000-lag, delta=AudioBlock.SampleRate*.02)
+        self.assertEqual(other_block.play_pos, 0)
+
+    def test_missed_deadlines_fall_back_to_normal_buffers(self):
+        server = AudioServer(low_latency=True)
+        block = SlowBlock()
+        server.add_block(block)
+        server.play()
+
+        give_up_at = time.time()+2
+        while server.low_latency and time.time()<give_up_at:
+            time.sleep(.01)
+        time.sleep(.1)
+        self.assertFalse(server.low_latency)
+        self.assertEqual(server.frames_per_buffer, AudioBlock.FramesPerBuffer)
+        streams = server.pa_manager.streams
+        self.assertEqual([stream.frames_per_buffer for stream in streams],
+                         [AudioServer.DefaultLowLatencyFrames, AudioBlock.FramesPerBuffer])
+        self.assertEqual(block.frame_counts[-1], AudioBlock.FramesPerBuffer)
+        #the callback and the render thread never rendered at the same time
+        self.assertEqual(block.max_rendering_count, 1)
+
+if __name__ == "__main__":
+    unittest.main()
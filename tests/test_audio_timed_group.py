@@ -0,0 +1,197 @@
+import unittest
+import tempfile
+import shutil
+import os
+import numpy
+import scipy.io.wavfile
+from blockaudio.audio_blocks import AudioBlock, AudioSamplesBlock, AudioTimedGroup
+from blockaudio.audio_blocks.audio_block import AudioBlockTime
+from blockaudio.audio_blocks.audio_timed_group import TimedBlockIndex
+from blockaudio.commons import AudioMessage
+from test_audio_group import render_while_locked
+
+def new_samples_block(sample_count, value=1.):
+    samples = numpy.ones((sample_count, AudioBlock.ChannelCount), dtype=numpy.float32)
+    return AudioSamplesBlock(samples*value)
+
+def render(block, frame_count, chunk_frames):
+    out = AudioBlock.get_blank_data(frame_count)
+    for start_pos in xrange(0, frame_count, chunk_frames):
+        count = min(chunk_frames, frame_count-start_pos)
+        block.get_samples(count, start_from=start_pos, use_loop=False,
+                          out=out[start_pos:start_pos+count, :], offline=True)
+    return out
+
+class LateSamplesBlock(AudioSamplesBlock):
+    #stands in for a file block whose samples are loaded in the background
+    def __init__(self, samples):
+        super(LateSamplesBlock, self).__init__(samples)
+        self.samples_loaded = False
+
+    def are_samples_loaded(self, start_pos=0, end_pos=None):
+        return self.samples_loaded
+
+    def get_samples(self, frame_count, start_from=None, use_loop=True,
+                          loop=None, out=None, offline=False):
+        if not self.samples_loaded:
+            if out is None:
+                out = self.get_blank_data(frame_count)
+            self.current_pos += frame_count
+            return AudioMessage(out)
+        return super(LateSamplesBlock, self).get_samples(
+            frame_count, start_from=start_from, use_loop=use_loop,
+            loop=loop, out=out, offline=offline)
+
+class TimedGroupTest(unittest.TestCase):
+    def new_nested_group(self, child_loop):
+        top_group = AudioTimedGroup()
+        sub_group = AudioTimedGroup()
+        sub_group.set_loop(AudioBlock.LOOP_NONE)
+        child = new_samples_block(900)
+        child.set_loop(child_loop)
+        sub_group.add_block(child, 0, AudioBlockTime.TIME_UNIT_SAMPLE, None)
+        top_group.add_block(sub_group, 1000, AudioBlockTime.TIME_UNIT_SAMPLE, None)
+        sub_group.set_duration(500, None)
+        return top_group, sub_group
+
+    def test_children_are_added_into_the_given_buffer(self):
+        group = AudioTimedGroup()
+        group.add_block(new_samples_block(500, .25), 100, AudioBlockTime.TIME_UNIT_SAMPLE, None)
+        group.add_block(new_samples_block(500, .5), 300, AudioBlockTime.TIME_UNIT_SAMPLE, None)
+        out = AudioBlock.get_blank_data(1000)
+        out.fill(1.)
+        message = group.get_samples(1000, start_from=0, use_loop=False, out=out)
+        self.assertIs(message.samples, out)
+        self.assertEqual(list(out[[99, 100, 299, 300, 599, 600, 799, 800], 0]),
+                         [1., 1.25, 1.25, 1.75, 1.75, 1.5, 1.5, 1.])
+
+        samples = group.get_samples(1000, start_from=0, use_loop=False).samples
+        self.assertTrue(numpy.array_equal(samples+1., out))
+
+    def test_render_does_not_wait_for_the_group_lock(self):
+        group = AudioTimedGroup()
+        group.add_block(new_samples_block(500), 100, AudioBlockTime.TIME_UNIT_SAMPLE, None)
+        results = render_while_locked(group, lambda: render(group, 1000, 256))
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0][100, 0], 1.)
+        self.assertEqual(results[0][600, 0], 0.)
+
+    def test_nested_group_is_chunk_size_independent(self):
+        for child_loop in (AudioBlock.LOOP_NONE, AudioBlock.LOOP_INFINITE):
+            top_group, sub_group = self.new_nested_group(child_loop)
+            small_chunks = render(top_group, 3000, 1024)
+            large_chunks = render(top_group, 3000, 5000)
+            self.assertTrue(numpy.array_equal(small_chunks, large_chunks))
+            self.assertEqual(small_chunks[1499, 0], 1.)
+            self.assertEqual(small_chunks[1500, 0], 0.)
+
+    def test_render_cache_skips_unloaded_blocks(self):
+        group = AudioTimedGroup()
+        child = LateSamplesBlock(numpy.ones((900, AudioBlock.ChannelCount), dtype=numpy.float32))
+        group.add_block(child, 100, AudioBlockTime.TIME_UNIT_SAMPLE, None)
+        out = AudioBlock.get_blank_data(1000)
+        group.get_samples(1000, start_from=0, use_loop=False, out=out)
+        self.assertFalse(out.any())
+        child.samples_loaded = True
+        out = AudioBlock.get_blank_data(1000)
+        group.get_samples(1000, start_from=0, use_loop=False, out=out)
+        self.assertEqual(out[99, 0], 0.)
+        self.assertEqual(out[100, 0], 1.)
+        self.assertEqual(out[999, 0], 1.)
+
+    def test_resized_nested_group_updates_owner_index(self):
+        top_group, sub_group = self.new_nested_group(AudioBlock.LOOP_NONE)
+        self.assertEqual(top_group.block_index.get_end_pos(), 1500)
+        self.assertEqual(len(top_group.block_index.get_blocks_within(1600, 1700)), 0)
+
+        sub_group.set_duration(800, None)
+        self.assertEqual(top_group.block_index.get_end_pos(), 1800)
+        self.assertEqual(top_group.duration, 1800)
+        found = top_group.block_index.get_blocks_within(1600, 1700)
+        self.assertEqual([entry[2] for entry in found], [sub_group])
+        self.assertEqual(render(top_group, 2000, 1024)[1799, 0], 1.)
+
+        sub_group.set_duration_value(200, None)
+        self.assertEqual(top_group.block_index.get_end_pos(), 1200)
+        self.assertEqual(len(top_group.block_index.get_blocks_within(1300, 1400)), 0)
+
+    def new_linked_copies(self):
+        group = AudioTimedGroup()
+        group.add_block(new_samples_block(900), 100, AudioBlockTime.TIME_UNIT_SAMPLE, None)
+        group.set_duration(1000, None)
+        linked_copy = group.copy(linked=True)
+        xml_copy = AudioTimedGroup.create_from_xml(linked_copy.get_xml_element(), [], group)
+        return group, linked_copy, xml_copy
+
+    def test_linked_copies_share_render_cache(self):
+        group, linked_copy, xml_copy = self.new_linked_copies()
+        render(group, 1000, 1000)
+        state = group.render_cache.state
+        for copy in (linked_copy, xml_copy, group, xml_copy):
+            out = render(copy, 1000, 1000)
+            self.assertIs(copy.render_cache.state, state)
+            self.assertEqual(out[100, 0], 1.)
+
+        group.set_block_position(group.blocks[0], 200, None)
+        out = render(xml_copy, 1000, 1000)
+        self.assertIsNot(xml_copy.render_cache.state, state)
+        self.assertEqual(out[100, 0], 0.)
+        self.assertEqual(out[200, 0], 1.)
+
+    def test_save_to_wav_file(self):
+        group = AudioTimedGroup()
+        group.add_block(new_samples_block(900, .5), 100, AudioBlockTime.TIME_UNIT_SAMPLE, None)
+        group.add_block(new_samples_block(900, .25), 5000, AudioBlockTime.TIME_UNIT_SAMPLE, None)
+        temp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(temp_dir, "song.wav")
+            group.save_to_file(filename)
+            sample_rate, samples = scipy.io.wavfile.read(filename)
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertEqual(sample_rate, int(AudioBlock.SampleRate))
+        self.assertTrue(numpy.array_equal(samples, render(group, group.duration, 1024)))
+
+class TimedBlockIndexTest(unittest.TestCase):
+    def new_block(self, start_pos, duration, loop=AudioBlock.LOOP_NONE):
+        block = AudioBlock()
+        block.set_loop(loop)
+        block.start_time.set_sample_count(start_pos, None)
+        block.set_duration(duration, None)
+        return block
+
+    def assert_lookups(self, blocks, index):
+        for start_pos in xrange(0, 1000*1000+5000, 997):
+            end_pos = start_pos+1024
+            expected = []
+            for i in xrange(len(blocks)):
+                block = blocks[i]
+                block_start_pos = block.start_time.sample_count
+                if block.loop == AudioBlock.LOOP_INFINITE:
+                    overlaps = block_start_pos<end_pos
+                else:
+                    overlaps = block_start_pos<end_pos and \
+                               block_start_pos+block.duration>start_pos
+                if overlaps:
+                    expected.append((i, block_start_pos, block))
+            self.assertEqual(index.get_blocks_within(start_pos, end_pos), expected)
+
+    def test_long_block_at_start_is_kept_aside(self):
+        blocks = [self.new_block(0, 1000*1000)]
+        for i in xrange(1000):
+            blocks.append(self.new_block(i*1000, 700))
+        blocks.append(self.new_block(500*1000, 300*1000))
+        blocks.append(self.new_block(2000, 100, AudioBlock.LOOP_INFINITE))
+        index = TimedBlockIndex()
+        index.rebuild(blocks)
+        starts, entries, long_entries, infinite_entries, end_pos, max_length = index.snapshot
+        self.assertEqual(max_length, 700)
+        self.assertEqual([entry[2] for entry in long_entries], [0, 1001])
+        self.assertEqual(end_pos, 1000*1000)
+        self.assert_lookups(blocks, index)
+
+        found = index.get_blocks_within(600*1000+100, 600*1000+900)
+        self.assertEqual([entry[0] for entry in found], [0, 601, 1001, 1002])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import tempfile
+import shutil
+import os
+import numpy
+from blockaudio.commons import FFmpegAudioWriter
+
+class FFmpegAudioWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def new_ffmpeg_binary(self, script):
+        #stands for ffmpeg, it gets the same arguments and stdin
+        filename = os.path.join(self.temp_dir, "ffmpeg")
+        with open(filename, "w") as f:
+            f.write("#!/bin/sh\n"+script+"\n")
+        os.chmod(filename, 0755)
+        return filename
+
+    def test_frames_are_piped_as_raw_float(self):
+        ffmpeg_binary = self.new_ffmpeg_binary('for arg; do target="$arg"; done; cat > "$target"')
+        filename = os.path.join(self.temp_dir, "song.ogg")
+        writer = FFmpegAudioWriter(filename, 44100, 2, ffmpeg_binary=ffmpeg_binary)
+        samples = numpy.linspace(-1, 1, 2000).reshape(-1, 2)
+        writer.write(samples[:300])
+        writer.write(samples[300:])
+        writer.close()
+
+        written = numpy.fromfile(filename, dtype="<f4").reshape(-1, 2)
+        self.assertTrue(numpy.array_equal(written, samples.astype(numpy.float32)))
+
+    def test_ffmpeg_failure_is_raised(self):
+        ffmpeg_binary = self.new_ffmpeg_binary('echo "unknown encoder" >&2; exit 1')
+        writer = FFmpegAudioWriter(
+            os.path.join(self.temp_dir, "song.xyz"), 44100, 2, ffmpeg_binary=ffmpeg_binary)
+        #ffmpeg may be gone before the first write, or only noticed when closing
+        with self.assertRaises(IOError) as context:
+            writer.write(numpy.zeros((10, 2)))
+            writer.close()
+        self.assertIn("unknown encoder", str(context.exception))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+from blockaudio.commons import MidiMessage
+from blockaudio.audio_blocks import AudioBlock
+
+class MidiMessageTest(unittest.TestCase):
+    def test_note_bytes_at_edge_values(self):
+        self.assertEqual(MidiMessage.note_on(0, "C0", 0, 0).midi_bytes, (0x90, 0, 0))
+        self.assertEqual(MidiMessage.note_on(5, "G10", 15, 127).midi_bytes, (0x9F, 127, 127))
+        self.assertEqual(MidiMessage.note_off(0, "A4", 15).midi_bytes, (0x8F, 57, 0))
+        message = MidiMessage.note_on(0, "G10", 15, 127).mido_message
+        self.assertEqual((message.type, message.channel, message.note, message.velocity),
+                         ("note_on", 15, 127, 127))
+
+    def test_out_of_range_values_are_rejected(self):
+        self.assertRaises(ValueError, MidiMessage.note_on, 0, "C5", 16, 64)
+        self.assertRaises(ValueError, MidiMessage.note_on, 0, "C5", -1, 64)
+        self.assertRaises(ValueError, MidiMessage.note_on, 0, "C5", 0, 128)
+        self.assertRaises(ValueError, MidiMessage.note_off, 0, "G#10", 0)
+        self.assertRaises(ValueError, MidiMessage.note_off, 0, "C5", 17)
+
+    def test_invalid_bytes_do_not_parse(self):
+        self.assertEqual(MidiMessage.bytes_to_mido((0x90, 200, 3)), None)
+        self.assertEqual(MidiMessage.bytes_to_mido((0x90, 60)), None)
+        self.assertEqual(MidiMessage.bytes_to_mido(()), None)
+        self.assertEqual(MidiMessage.bytes_to_mido((0x90, 60, 3)).note, 60)
+
+    def test_block_keeps_midi_values_in_range(self):
+        block = AudioBlock()
+        block.set_midi_channel(17)
+        self.assertEqual(block.midi_channel, None)
+        block.set_midi_channel(15)
+        self.assertEqual(block.midi_channel, 15)
+        block.set_midi_velocity(128)
+        self.assertEqual(block.new_midi_note_on_message(0).midi_bytes, (0x9F, 60, 127))
+        block.set_midi_velocity(-3)
+        self.assertEqual(block.midi_velocity, 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import numpy
+from blockaudio.commons import SamplesProcessor
+
+def new_tone(frequency, frame_count, sample_rate=44100.):
+    tone = numpy.sin(numpy.arange(frame_count)*2*numpy.pi*frequency/sample_rate)
+    return numpy.repeat(tone.astype(numpy.float32).reshape(-1, 1), 2, axis=1)
+
+def get_rms(samples):
+    return numpy.sqrt((samples.astype(numpy.float64)**2).mean())
+
+def get_peak_frequency(samples, sample_rate=44100.):
+    spectrum = numpy.abs(numpy.fft.rfft(samples[:, 0]*numpy.hanning(samples.shape[0])))
+    return numpy.argmax(spectrum)*sample_rate/samples.shape[0]
+
+class ResampleTest(unittest.TestCase):
+    def test_speed_up_moves_pitch_and_length(self):
+        factor = 2**(7/12.)
+        resampled = SamplesProcessor.speed_up(new_tone(440, 44100), factor)
+        self.assertEqual(resampled.dtype, numpy.float32)
+        self.assertAlmostEqual(resampled.shape[0], 44100/factor, delta=44100*.001)
+        self.assertAlmostEqual(get_peak_frequency(resampled), 440*factor, delta=3)
+        self.assertAlmostEqual(get_rms(resampled[1000:-1000]), numpy.sqrt(.5), delta=.01)
+
+    def test_ratio_keeps_pitch_close(self):
+        #largest pitch error in cents per quality
+        for quality, max_cents in ((SamplesProcessor.QUALITY_LOW, 2.),
+                                   (SamplesProcessor.QUALITY_MEDIUM, .5),
+                                   (SamplesProcessor.QUALITY_HIGH, .05)):
+            max_denominator = SamplesProcessor.QUALITY_SETTINGS[quality][0]
+            for semitones in xrange(-24, 25):
+                factor = 2**(semitones/12.)
+                up, down = SamplesProcessor.get_resample_ratio(factor, quality)
+                self.assertLessEqual(min(up, down), max_denominator)
+                cents = 1200*numpy.log2(down*1./up/factor)
+                self.assertLess(abs(cents), max_cents, (semitones, quality))
+
+    def test_content_above_the_new_nyquist_is_filtered(self):
+        tone = new_tone(15000, 44100)
+        nearest = SamplesProcessor.speed_up(tone, 2, SamplesProcessor.QUALITY_NEAREST)
+        self.assertGreater(get_rms(nearest), .5)
+        for quality in (SamplesProcessor.QUALITY_MEDIUM, SamplesProcessor.QUALITY_HIGH):
+            filtered = SamplesProcessor.speed_up(tone, 2, quality)
+            self.assertLess(get_rms(filtered[500:-500]), .01)
+
+    def test_kernels_are_built_once(self):
+        up, down = SamplesProcessor.get_resample_ratio(1.5, SamplesProcessor.QUALITY_LOW)
+        kernel = SamplesProcessor.get_resample_kernel(up, down, SamplesProcessor.QUALITY_LOW)
+        self.assertIs(SamplesProcessor.Kernels[(up, down, SamplesProcessor.QUALITY_LOW)], kernel)
+        self.assertIs(SamplesProcessor.get_resample_kernel(
+            up, down, SamplesProcessor.QUALITY_LOW), kernel)
+
+    def test_unchanged_speed_copies_samples(self):
+        samples = new_tone(440, 1000)
+        resampled = SamplesProcessor.speed_up(samples, 1.)
+        self.assertTrue(numpy.array_equal(resampled, samples))
+        self.assertIsNot(resampled, samples)
+
+class StretchTest(unittest.TestCase):
+    def test_stretch_changes_length_and_keeps_pitch(self):
+        tone = new_tone(440, 44100)
+        for factor in (.5, .8, 1.5):
+            stretched = SamplesProcessor.stretch(tone, factor, 2048, 256)
+            self.assertEqual(stretched.dtype, numpy.float32)
+            self.assertAlmostEqual(stretched.shape[0], 44100/factor, delta=44100*.01)
+            self.assertAlmostEqual(get_peak_frequency(stretched), 440, delta=5)
+            middle = stretched[stretched.shape[0]//4:-stretched.shape[0]//4]
+            self.assertAlmostEqual(get_rms(middle), numpy.sqrt(.5), delta=.05)
+
+    def test_batches_do_not_change_the_result(self):
+        tone = new_tone(440, 20000)
+        batch_values = SamplesProcessor.StretchBatchValues
+        try:
+            whole = SamplesProcessor.stretch(tone, .7, 1024, 128)
+            SamplesProcessor.StretchBatchValues = 1024*2*3
+            batched = SamplesProcessor.stretch(tone, .7, 1024, 128)
+        finally:
+            SamplesProcessor.StretchBatchValues = batch_values
+        self.assertTrue(numpy.allclose(whole, batched, atol=1e-5))
+
+    def test_single_channel_samples_keep_their_shape(self):
+        tone = new_tone(440, 20000)
+        stretched = SamplesProcessor.stretch(tone[:, 0], .5, 1024, 128)
+        self.assertEqual(stretched.ndim, 1)
+        self.assertTrue(numpy.allclose(
+            stretched, SamplesProcessor.stretch(tone, .5, 1024, 128)[:, 0], atol=1e-5))
+
+class PitchShiftTest(unittest.TestCase):
+    def test_window_follows_sample_count(self):
+        self.assertEqual(SamplesProcessor.get_pitch_shift_window(100),
+                         SamplesProcessor.PitchShiftMinWindow)
+        self.assertEqual(SamplesProcessor.get_pitch_shift_window(4000), 512)
+        self.assertEqual(SamplesProcessor.get_pitch_shift_window(10**7),
+                         SamplesProcessor.PitchShiftMaxWindow)
+
+    def test_short_samples_keep_their_level(self):
+        for frame_count in (3000, 44100):
+            shifted = SamplesProcessor.pitch_shift(new_tone(440, frame_count), 2**(7/12.))
+            self.assertAlmostEqual(shifted.shape[0], frame_count, delta=frame_count*.01)
+            middle = shifted[frame_count//4:-frame_count//4]
+            self.assertAlmostEqual(get_rms(middle), numpy.sqrt(.5), delta=.05)
+
+if __name__ == "__main__":
+    unittest.main()